@@ -1,25 +1,47 @@
 from __future__ import absolute_import
-from binaryninja import Architecture, BinaryViewType
-from .architecture import MCS51
-from .binaryview import Family8051View
-from .experiments.calling_conventions import SDCCCall, KeilCall, IARCall
-from .experiments.calling_conventions import YoloCall
-from .devices import surface_ec, coastermelt, inic_3609, vl811
+import os, sys
 
 __version__ = '0.0.0'
-__all__ = ['MCS51']
+__all__ = ['MCS51', 'register']
 
-MCS51.register()
-Family8051View.register()
+def register():
+    """Registers the architecture and views with Binary Ninja."""
+    from binaryninja import Architecture
+    from .architecture import MCS51
+    MCS51.register()
 
-if 1:
-    # experimental, not sure how useful it is yet
-    arch = Architecture['8051']
-    def reg_cc(cls):  # API change?
-        cc = cls(arch, cls.name)
-        arch.register_calling_convention(cc)
-    [reg_cc(cc) for cc in [SDCCCall, KeilCall, IARCall, YoloCall]]
+    if os.environ.get('I8051_EAGER'):
+        from .binaryview import Family8051View
+        from .experiments import calling_conventions
+        from .devices import surface_ec, coastermelt, inic_3609, vl811
+        from .devices import intel_hex, profile, classes
 
-    yolo_cc = YoloCall(arch, YoloCall.name)
-    arch.standalone_platform.default_calling_convention = yolo_cc
-    arch.standalone_platform.system_calling_convention = yolo_cc
+        Family8051View.register()
+        for view in [intel_hex.IntelHexView, surface_ec.SurfaceECView,
+                     coastermelt.CoastermeltUSBView, inic_3609.Initio3609,
+                     vl811.VL811View]:
+            view.register()
+        for view in profile.generic_views(skip=list(classes)):
+            view.register()
+        calling_conventions.register(Architecture['8051'])
+    else:
+        from . import lazy  # see there for what gets deferred
+        for view in lazy.views():
+            view.register()
+
+def _headless():
+    """Headless tools like disassembler.batch don't want the host core (or a
+    license), and have to work without binaryninja installed. `python -m
+    i8051.<tool>` imports this package first, while argv[0] is still '-m';
+    their worker processes get I8051_HEADLESS instead."""
+    if sys.argv[:1] == ['-m'] or os.environ.get('I8051_HEADLESS'):
+        return True
+    try:
+        import binaryninja
+    except ImportError:
+        return True
+    return False
+
+if not _headless():
+    register()
+    from .architecture import MCS51
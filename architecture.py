@@ -1,5 +1,6 @@
 from __future__ import print_function
-import time, traceback
+import os, copy, time, json, hashlib, inspect, threading, traceback
+import functools
 import binaryninja
 from binaryninja.architecture import Architecture
 from binaryninja.lowlevelil import LowLevelILFunction, LowLevelILLabel, LLIL_TEMP
@@ -9,9 +10,9 @@ from binaryninja.enums import (BranchType, LowLevelILOperation,
                             LowLevelILFlagCondition, FlagRole, Endianness)
 from . import mem
 from .disassembler import specification
-from .disassembler import ana, emu, out
+from .disassembler import ana, ana_op, emu, out
 from . import lowlevelil
-from .experiments import llil_mangler
+from .experiments import llil_mangler, calling_conventions
 
 class MCS51(Architecture):
     """
@@ -20,6 +21,14 @@ class MCS51(Architecture):
     """
     name = "8051"
 
+    # Flash banking geometry this instance decodes for, and the family its
+    # SFR names come from (see sfrs.families). Views with anything else get
+    # their own registered subclass, see `variant`.
+    bank_layout = mem.default_layout
+    sfr_family = '8052'
+    _variants = {}  # :: {(BankLayout.mapping(), sfr_family): MCS51}
+    _variants_lock = threading.Lock()
+
     # C 'pointers' tend to be 3 bytes, but architecture-wise it's just 2?
     # Our fake address space that keeps all flash banks mapped needs 3.
     # Full XRAM/IRAM tags need 5.
@@ -119,48 +128,124 @@ class MCS51(Architecture):
         LowLevelILFlagCondition.LLFC_NO: ["ov"],
     }
 
+    # Decoded instructions shared between the get_instruction_* callbacks,
+    # since analysis tends to hit the same address repeatedly. One cache per
+    # instance, so per bank layout. Resize with `resize_decode_cache`, check
+    # hit rates with `decoded.cache_info()`.
+    decode_cache_size = 0x4000
+
+    # Load spec-derived tables from `Tables.artifact` rather than refining
+    # them on every start, see `Tables.load`. Roughly break-even on CPython,
+    # where refining only takes milliseconds; check the log for timings.
+    table_cache = False
+
     def get_instruction_info(self, data, addr):
         if not len(data):
             return  # edge case during linear sweep
-        nfo = InstructionInfo()
-        # ana
-        size, branch = self.lut.branches[data[0]]
-        nfo.length = size
-        # emu
-        if branch:
-            branch_type, target = branch
-            if callable(target):
-                target = target(data, addr, size) if size <= len(data) else 0
-            if branch_type == BranchType.CallDestination:
-                # TODO: keep track of return-effect functions, tweak target +=dx
-                pass
-                # TODO: arch is probably global; need to store this in bv somehow :|
-            nfo.add_branch(branch_type, target=target)
-            if branch_type == BranchType.TrueBranch:
-                nfo.add_branch(BranchType.FalseBranch, addr + size)
-        return nfo
+        size, branch_type, _ = self.lut.info[data[0]]
+        if branch_type is None:
+            return self.lut.no_branch[size]  # shared, never mutated
+        if size > len(data):
+            return self.instruction_info(data, addr)
+        return self.decoded(addr, data[:size])[2]
         
     def get_instruction_text(self, data, addr):
         # ana
-        size, vals = self.lut.decoders[data[0]]
+        size = self.lut.info[data[0]][0]
         assert len(data) >= size
-        vals = [decoder(data, addr, size) for decoder in vals]
+        _, vals, _ = self.decoded(addr, data[:size])
         # out / outop
         toks = self.lut.text[data[0]]
-        return out.render(toks, vals), size
+        return out.render(toks, vals, self.sfr_names), size
 
     def get_instruction_low_level_il(self, data, addr, il):
         # ana
         code = data[0]
-        size, vals = self.lut.decoders[code]
+        size = self.lut.info[code][0]
         if len(data) < size:
             # incomplete code due to disassembling data or missing memory
             return size  # abort further analysis before it errors
-        vals = [decoder(data, addr, size) for decoder in vals]
+        _, vals, _ = self.decoded(addr, data[:size])
         # sem
-        build = llil_mangler.patch_at(self, addr) or self.lut.llil[code]
+        lift = lowlevelil.lift_context(il, self, addr)
+        build = llil_mangler.patch_at(lift, il, addr) or self.lut.llil[code]
         size_override = build(il, vals, addr)
-        return size_override if size_override != None else size
+        if size_override != None:
+            size = size_override
+        lift.next = addr + size if self.lut.falls_through[code] else None
+        return size
+
+    @specification.lazy_memoized_property
+    def decoded(self):
+        """LRU-cached `decode`, keyed by (addr, instruction bytes)."""
+        return functools.lru_cache(self.decode_cache_size)(self.decode)
+
+    def resize_decode_cache(self, size):
+        """Drops everything cached so far."""
+        self.decode_cache_size = size
+        self.decoded = functools.lru_cache(size)(self.decode)
+
+    @classmethod
+    def variant(cls, layout, sfr_family='8052'):
+        """The architecture for views banked by `layout`, a mem.BankLayout,
+        with SFRs named after `sfr_family`.
+
+        The host passes no view to get_instruction_info(..) and friends, so
+        anything decoding or rendering depends on has to come with the
+        architecture. Each combination gets a subclass, registered on first
+        use and named after it, so databases saved with it find it again
+        once a view of the same kind opens. The defaults are plain '8051'.
+
+        Layouts are told apart by their mapping only (BankLayout.mapping),
+        so the first one seen stands in for any with another bank count.
+        """
+        key = layout.mapping(), sfr_family
+        if key == (cls.bank_layout.mapping(), cls.sfr_family):
+            return Architecture[cls.name]
+        with cls._variants_lock:
+            if key not in cls._variants:
+                name = cls.name
+                if key[0] != cls.bank_layout.mapping():
+                    name += '-%x-%x-%x' % key[0]
+                if sfr_family != cls.sfr_family:
+                    name += '-' + sfr_family
+                arch = type(cls.__name__ + '_Variant', (cls,),
+                            {'name': name, 'bank_layout': layout,
+                             'sfr_family': sfr_family})
+                arch.register()
+                cls._variants[key] = Architecture[name]
+            return cls._variants[key]
+
+    @specification.lazy_memoized_property
+    def sfr_names(self):
+        """Rendered SFR operands, see out.SfrNames."""
+        return out.sfr_names(self.sfr_family)
+
+    def decode(self, addr, data):
+        """Decode a complete instruction, uncached.
+
+        returns: (size, operand values, InstructionInfo)
+        """
+        size, decoders = self.lut.operands[data[0]]
+        vals = tuple(decoder(data, addr, size) for decoder in decoders)
+        return size, vals, self.instruction_info(data, addr)
+
+    def instruction_info(self, data, addr):
+        """get_instruction_info(..) without caching, see `Tables.info`"""
+        # ana + emu, flattened into one lookup
+        size, branch_type, target = self.lut.info[data[0]]
+        if branch_type is None:
+            return self.lut.no_branch[size]
+        if callable(target):
+            target = target(data, addr) if size <= len(data) else 0
+        # TODO: keep track of return-effect functions, tweak call target +=dx
+        # TODO: arch is probably global; need to store this in bv somehow :|
+        nfo = InstructionInfo()
+        nfo.length = size
+        nfo.add_branch(branch_type, target=target)
+        if branch_type == BranchType.TrueBranch:
+            nfo.add_branch(BranchType.FalseBranch, addr + size)
+        return nfo
         
     #def get_flag_condition_low_level_il(self, cond, il):
     #    il.append(il.unimplemented())
@@ -205,8 +290,15 @@ class MCS51(Architecture):
         processing should be deferred until needed using this decorator.
         """
 
-        luts = Tables()
-        if 1:  # DEBUG
+        # First real use of the architecture, so the platform's about to be.
+        calling_conventions.register(self)
+        if self.name != MCS51.name:
+            # Only bank arithmetic and SFR names differ, the rest is shared.
+            luts = copy.copy(Architecture[MCS51.name].lut)
+            luts.specialize(self.bank_layout)
+            return luts
+        luts = Tables(Tables.artifact if self.table_cache else None)
+        if binaryninja.core_ui_enabled():  # DEBUG, pointless when headless
             urls = [
                 ('spu plugin',
             'https://github.com/bambu/binaryninja-spu/blob/master/spu.py'),
@@ -250,18 +342,157 @@ class MCS51(Architecture):
 
 
 class Tables:
-    def __init__(self):
+    """Per-opcode lookup tables refined from `specification`.
+
+    The decoder, branch and text tables only depend on the spec and on the
+    modules refining it, so they can be built once and stored as names of
+    the functions and tokens involved. The parsed spec rows are stored too,
+    so a load never parses the spec. Anything that's a closure (llil) or
+    derived from the stored tables gets rebuilt on load.
+    """
+    version = 1  # bump whenever the artifact layout changes
+    builds = 0  # per process, should stay at 1, see benchmarks.thread_safety
+    artifact = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '8051_tables.json')
+
+    def __init__(self, artifact=None):
+        Tables.builds += 1
         elapsed = time.time()
 
-        spec = specification.InstructionSpec()
-        self.decoders = spec.refine(ana.operand_decoders)
-        self.branches = spec.refine(emu.branch_type)
-        self.text = spec.refine(out.tokens)
-        self.llil = spec.refine(lowlevelil.low_level_il)
+        digest = artifact and self.digest()
+        built = artifact and self.load(artifact, digest)
+        if not built:
+            spec = specification.InstructionSpec()
+            self.spec = spec.spec
+            self.decoders = spec.refine(ana.operand_decoders)
+            self.branches = spec.refine(emu.branch_type)
+            self.text = spec.refine(out.tokens)
+        # Published as tuples all the way down, since every analysis thread
+        # reads these without locking.
+        self.decoders = _tuples(self.decoders)
+        self.branches = _tuples(self.branches)
+        self.text = _tuples(self.text)
+        self.specialize(mem.default_layout)
+        self.no_branch = {}
+        for size, _ in self.branches:
+            self.no_branch[size] = nfo = InstructionInfo()
+            nfo.length = size
+        self.llil = tuple(lowlevelil.low_level_il(*op) for op in self.spec)
+        # Whether the next instruction lifted is in the same basic block,
+        # see lowlevelil.lift_context. Calls end blocks on no-return targets.
+        self.falls_through = tuple(
+            not branch or branch[0] == BranchType.TrueBranch
+            for _, branch in self.branches)
 
-        # FIXME hack until I refactor this a bit:
-        self.unlifted = lowlevelil.unlifted_todo(spec.spec, self.llil)
-        
         elapsed = time.time() - elapsed
-        log_info('Building 8051 tables took %0.3f seconds' % elapsed)
-        
+        if built:
+            log_info('Loading 8051 tables took %0.3f seconds, '
+                     'building them took %0.3f' % (elapsed, built))
+        else:
+            log_info('Building 8051 tables took %0.3f seconds' % elapsed)
+            if artifact:
+                self.save(artifact, digest, elapsed)
+
+    # FIXME hack until I refactor this a bit:
+    @specification.lazy_memoized_property
+    def unlifted(self):
+        """Markdown table of opcodes without LLIL, for the debug report."""
+        return lowlevelil.unlifted_todo(self.spec, self.llil)
+
+    def specialize(self, layout):
+        """Tables with flash bank arithmetic baked in for `layout`, which is
+        a mem.BankLayout. Cheap, doesn't touch the spec.
+
+        info :: [(size, BranchType | None, target_fn | ea)], see emu.fast_branch
+        operands :: [(size, [op_decoders])], `decoders` specialized
+        """
+        # Built aside, then each table is swapped in whole.
+        info = tuple(emu.fast_branch(code, *self.branches[code], layout=layout)
+                     for code in range(len(self.branches)))
+        operands = _tuples([(size, [ana_op.specialize(d, layout) for d in ds])
+                            for size, ds in self.decoders])
+        self.layout, self.info, self.operands = layout, info, operands
+
+    # Modules whose functions and tokens may appear in stored tables.
+    _modules = {m.__name__.rsplit('.', 1)[-1]: m for m in [ana_op, emu, out]}
+
+    @classmethod
+    def digest(cls):
+        """Changes whenever the spec, or the code refining it, does."""
+        h = hashlib.sha256(str(cls.version).encode())
+        for m in [specification, ana, ana_op, emu, out]:
+            h.update(inspect.getsource(m).encode())
+        return h.hexdigest()
+
+    def load(self, path, digest):
+        """Returns seconds the stored tables took to build, or 0 if stale."""
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+            if stored['digest'] != digest:
+                log_info('8051 tables at %s are stale, rebuilding' % path)
+                return 0
+            tokens = {}  # mostly repeats, like ', ' and 'A'
+            self.spec = stored['spec']
+            self.decoders = self._thaw(stored['decoders'], tokens)
+            self.branches = self._thaw(stored['branches'], tokens)
+            self.text = self._thaw(stored['text'], tokens)
+            return stored['seconds']
+        except FileNotFoundError:
+            return 0
+        except Exception:
+            log_warn('Bad 8051 table cache, rebuilding:\n' +
+                     traceback.format_exc())
+            return 0
+
+    def save(self, path, digest, seconds):
+        try:
+            stored = {'digest': digest, 'seconds': seconds, 'spec': self.spec,
+                      'decoders': self._freeze(self.decoders),
+                      'branches': self._freeze(self.branches),
+                      'text': self._freeze(self.text)}
+            with open(path, 'w') as f:
+                json.dump(stored, f, separators=(',', ':'))
+        except OSError as e:  # read-only plugin dir is fine, just slower
+            log_warn('Could not cache 8051 tables: %s' % e)
+        except AssertionError:  # something _freeze can't name, see _thaw
+            log_warn('Could not cache 8051 tables:\n' +
+                     traceback.format_exc())
+
+    @classmethod
+    def _freeze(cls, x):
+        """Tables -> JSON, with everything but containers stored by name."""
+        if isinstance(x, (list, tuple)):
+            return [cls._freeze(y) for y in x]
+        if isinstance(x, out.TT):
+            return {'tt': [x.type.name, x.text]}
+        if isinstance(x, BranchType):
+            return {'branch': x.name}
+        if callable(x):
+            module = x.__module__.rsplit('.', 1)[-1]
+            fn = getattr(cls._modules.get(module), x.__name__, None)
+            assert fn is x, 'not stored by name: %r' % x
+            return {'fn': [module, x.__name__]}
+        return x
+
+    @classmethod
+    def _thaw(cls, x, tokens):
+        if isinstance(x, list):
+            return [cls._thaw(y, tokens) for y in x]
+        if isinstance(x, dict):
+            if 'tt' in x:
+                key = tuple(x['tt'])
+                if key not in tokens:
+                    tokens[key] = out.TT(out.TTT[key[0]], key[1])
+                return tokens[key]
+            if 'branch' in x:
+                return BranchType[x['branch']]
+            module, name = x['fn']
+            return getattr(cls._modules[module], name)
+        return x
+
+def _tuples(x):
+    """Nested lists -> nested tuples, leaving everything else alone."""
+    if isinstance(x, (list, tuple)):
+        return tuple(_tuples(y) for y in x)
+    return x
@@ -0,0 +1,295 @@
+"""Rough throughput numbers for the hot paths Binary Ninja calls into.
+
+Run headless, with the plugin importable as `i8051`:
+
+    python -m i8051.benchmarks
+
+Or from the scripting console via `i8051.benchmarks.main()`. Images are
+synthetic, seeded random bytes: real firmware decodes the same way, and it
+keeps runs comparable between machines and revisions.
+"""
+from __future__ import print_function
+import os, sys, random, time, ctypes, threading, traceback, subprocess
+import tempfile
+from binaryninja.architecture import Architecture
+from binaryninja.function import InstructionInfo
+from binaryninja.enums import BranchType
+from . import mem, lowlevelil, emulator, architecture
+
+def synthetic_image(size=0x10000, seed=0x8051):
+    rng = random.Random(seed)
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+def sweep(get_info, image, base=0):
+    """Linear sweep over `image`, returns instructions decoded."""
+    count, ea, end = 0, 0, len(image) - 2  # skip truncated last instruction
+    while ea < end:
+        nfo = get_info(image[ea:ea+3], base + ea)
+        ea += nfo.length
+        count += 1
+    return count
+
+def reference_instruction_info(lut, data, addr):
+    """get_instruction_info(..) as it was before `Tables.info` existed."""
+    nfo = InstructionInfo()
+    size, branch = lut.branches[data[0]]
+    nfo.length = size
+    if branch:
+        branch_type, target = branch
+        if callable(target):
+            target = target(data, addr, size) if size <= len(data) else 0
+        nfo.add_branch(branch_type, target=target)
+        if branch_type == BranchType.TrueBranch:
+            nfo.add_branch(BranchType.FalseBranch, addr + size)
+    return nfo
+
+def timed(name, f, *args, **kwargs):
+    """Best of `repeat` runs, since these are short and easily disturbed."""
+    elapsed = float('inf')
+    for _ in range(kwargs.get('repeat', 3)):
+        start = time.time()
+        count = f(*args)
+        elapsed = min(elapsed, time.time() - start)
+    print('%-40s %8d in %6.3fs, %10.0f/s' % (name, count, elapsed,
+                                             count / elapsed))
+    return count / elapsed
+
+def instruction_info(arch=None, image=None):
+    """Instructions per second through get_instruction_info(..)"""
+    arch = arch or Architecture['8051']
+    image = image or synthetic_image()
+    lut = arch.lut  # build outside the timed region
+    ref = lambda data, addr: reference_instruction_info(lut, data, addr)
+    for base, label in [(0, 'flat'), (0x10000, 'banked')]:
+        before = timed('get_instruction_info, before (%s)' % label,
+                       sweep, ref, image, base)
+        after = timed('get_instruction_info, after (%s)' % label,
+                      sweep, arch.get_instruction_info, image, base)
+        print('%-40s %8.2fx' % ('speedup', after / before))
+
+def instruction_text(arch=None, image=None):
+    """Lines per second through get_instruction_text(..), with a single cold
+    pass to show the effect of warm operand token caches."""
+    arch = arch or Architecture['8051']
+    image = image or synthetic_image()
+    text = lambda data, addr: _Length(arch.get_instruction_text(data, addr))
+    lut = arch.lut  # build outside the timed region
+    timed('get_instruction_text (cold)', sweep, text, image, 0, repeat=1)
+    timed('get_instruction_text (warm)', sweep, text, image, 0)
+
+def lift(arch, image, base=0):
+    """Lift every instruction in a linear sweep, returns IL expressions built."""
+    lut, il = arch.lut, _RecordingIL()
+    ea, end = 0, len(image) - 2
+    while ea < end:
+        if ea >> 8 != lowlevelil.lifting.key:  # as if functions were 256B
+            lowlevelil.lifting.reset(ea >> 8, arch)
+        code = image[ea]
+        size, vals, _ = arch.decoded(base + ea, image[ea:ea+lut.info[code][0]])
+        lut.llil[code](il, vals, base + ea)
+        ea += size
+    return len(il.exprs)
+
+def low_level_il(arch=None, image=None):
+    """Expressions per second out of the LLIL emitters, against a recording
+    stand-in for LowLevelILFunction so only our side of the lift is timed."""
+    arch = arch or Architecture['8051']
+    image = image or synthetic_image()
+    lut = arch.lut  # build outside the timed region
+    timed('low_level_il (flat)', lift, arch, image, 0)
+    timed('low_level_il (banked)', lift, arch, image, 0x10000)
+
+# XOR-decrypt XRAM 0x1000..0x2fff in place, over and over. The sort of loop
+# the emulator exists to run.
+_xor_loop = bytes([
+    0x90, 0x10, 0x00,  # 0000  mov   DPTR, #0x1000
+    0x7e, 0x20,        # 0003  mov   R6, #0x20
+    0x7f, 0x00,        # 0005  mov   R7, #0  (256 iterations)
+    0xe0,              # 0007  movx  A, @DPTR
+    0x64, 0x5a,        # 0008  xrl   A, #0x5a
+    0xf0,              # 000a  movx  @DPTR, A
+    0xa3,              # 000b  inc   DPTR
+    0xdf, 0xf9,        # 000c  djnz  R7, 0007
+    0xde, 0xf5,        # 000e  djnz  R6, 0005
+    0x80, 0xee,        # 0010  sjmp  0000
+])
+
+def emulate(steps):
+    m = emulator.Machine(_xor_loop)
+    return m.run(steps)
+
+def emulator_throughput():
+    """Instructions per second through emulator.Machine.run(..)"""
+    timed('emulator (xor loop)', emulate, 1 << 21)
+
+def emulator_call():
+    """Machine.call from inside the function it calls: pc starts out at the
+    return address, with the stack one frame deeper."""
+    m = emulator.Machine(bytes([0x74, 0x01,    # 0000  mov A, #1
+                                0x22]))        # 0002  ret
+    assert m.call(mem.CODE, steps=100) == 2
+    assert (m.pc, m.a, m.sp) == (mem.CODE, 1, 0x07)
+    print('%-40s %8s' % ('emulator call at return address', 'ok'))
+
+def reference_virtual(target, addr):
+    """mem.flash_bank_virtual as it was before mem.BankLayout."""
+    if addr > 0xFFff and target > 0x7Fff:
+        target += addr // 0x8000 * 0x8000 - 0x8000
+    return target + mem.CODE
+
+def reference_physical(addr):
+    """mem.flash_bank_physical as it was before mem.BankLayout."""
+    addr -= mem.CODE
+    while addr > 0xFFff:
+        addr -= 0x8000
+    return addr
+
+def map_banks(virtual, physical, addrs):
+    """Physical and back for every address, returns how many."""
+    for addr in addrs:
+        virtual(physical(addr) ^ 0x4000, addr)
+    return len(addrs)
+
+def bank_mapping():
+    """Address mappings per second over all 16 banks of a 32K layout."""
+    layout = mem.BankLayout(0x8000, 0x8000, 16)
+    addrs = range(mem.CODE, mem.CODE + layout.end, 3)
+    assert all(reference_virtual(reference_physical(a) ^ 0x4000, a) ==
+               layout.virtual(layout.physical(a) ^ 0x4000, a) for a in addrs)
+    before = timed('bank mapping, before', map_banks,
+                   reference_virtual, reference_physical, addrs)
+    after = timed('bank mapping, BankLayout', map_banks,
+                  layout.virtual, layout.physical, addrs)
+    print('%-40s %8.2fx' % ('speedup', after / before))
+
+def thread_safety(threads=8, arch=None, image=None):
+    """Stress check: the three instruction callbacks from `threads` threads
+    at once, starting with no tables built. They should get built once.
+
+    Drops the architecture's tables and decode cache first, so only run
+    this headless.
+    """
+    arch = arch or Architecture['8051']
+    image = image or synthetic_image(0x4000)
+    for name in ('lut', 'decoded'):
+        vars(arch).pop(name, None)
+    builds = architecture.Tables.builds
+    go, errors = threading.Barrier(threads), []
+
+    def hammer(ea):
+        il = _RecordingIL()
+        lowlevelil.lift_context(il, arch, ea).patches = {}  # no view to ask
+        il.append(il.nop())
+        go.wait()
+        try:
+            while ea < len(image) - 2:
+                data = image[ea:ea+3]
+                arch.get_instruction_text(data, ea)
+                arch.get_instruction_low_level_il(data, ea, il)
+                ea += arch.get_instruction_info(data, ea).length
+        except Exception:
+            errors.append(traceback.format_exc())
+
+    workers = [threading.Thread(target=hammer, args=(i,))
+               for i in range(threads)]
+    start = time.time()
+    for t in workers: t.start()
+    for t in workers: t.join()
+    builds = architecture.Tables.builds - builds
+    print('%-40s %8d threads in %6.3fs, %d table builds, %d errors' % (
+        'thread safety', threads, time.time() - start, builds, len(errors)))
+    for e in errors[:1]:
+        print(e)
+    assert builds == 1 and not errors
+
+def import_time(package=None, top=5):
+    """What importing the plugin costs a fresh interpreter, lazy and eager
+    registration, from its `python -X importtime` report."""
+    package = package or __package__
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    env.pop('I8051_EAGER', None)
+    for mode, extra in [('lazy', {}), ('eager', {'I8051_EAGER': '1'})]:
+        report = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + package],
+            env=dict(env, **extra), stderr=subprocess.PIPE,
+            universal_newlines=True).stderr
+        rows = []  # :: [(self us, cumulative us, module)]
+        for line in report.splitlines():
+            cols = line.partition('import time:')[2].split('|')
+            if len(cols) == 3 and cols[0].strip().isdigit():
+                rows.append((int(cols[0]), int(cols[1]), cols[2].strip()))
+        ours = [row for row in rows if row[2].split('.')[0] == package]
+        total = next((cum for _, cum, name in ours if name == package), 0)
+        name = 'import %s (%s)' % (package, mode)
+        print('%-40s %8d modules, %8.1fms' % (name, len(ours), total / 1000.))
+        for self_us, _, name in sorted(ours, reverse=True)[:top]:
+            print('    %-36s %8.1fms' % (name, self_us / 1000.))
+
+def headless_batch(package=None, size=0x4000):
+    """disassembler.batch in a fresh interpreter that can't import
+    binaryninja, both as a module and through its process pool."""
+    package = package or __package__
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+        f.write(synthetic_image(size))
+    path = f.name
+    script = ('import sys; sys.modules["binaryninja"] = None\n'
+              'from %s.disassembler import batch\n'
+              'batch.main(["-j", "2", "-f", "json", %r])\n'
+              'assert not [m for m in sys.modules\n'
+              '            if m.startswith("binaryninja.")]' % (package, path))
+    try:
+        start = time.time()
+        run = subprocess.run([sys.executable, '-c', script], env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    finally:
+        os.remove(path)
+    ok = run.returncode == 0 and '"instructions"' in run.stdout
+    print('%-40s %8d bytes in %6.3fs, %s' % (
+        'batch without binaryninja', size, time.time() - start,
+        'ok' if ok else 'FAILED'))
+    if not ok:
+        print(run.stderr)
+    assert ok
+
+class _RecordingIL:
+    """Just enough of LowLevelILFunction for the emitters: every builder call
+    is recorded and returns its expression index."""
+    def __init__(self):
+        self.exprs, self.insns = [], []
+        self.handle = ctypes.pointer(ctypes.c_char())  # see lift_context
+    def __getattr__(self, name):
+        def build(*args, **kwargs):
+            self.exprs.append((name, args))
+            return len(self.exprs) - 1
+        return build
+    def __getitem__(self, i): return _Expr(*self.exprs[i])
+    def __len__(self): return len(self.insns)
+    def append(self, expr): self.insns.append(expr)
+    def mark_label(self, label): pass
+    def get_label_for_address(self, arch, addr): return None
+
+class _Expr:
+    def __init__(self, name, args): self.operation, self.value = name, args[-1]
+
+class _Length:
+    """Adapt get_instruction_text(..) results to `sweep`."""
+    def __init__(self, result): self.length = result[1]
+
+def main():
+    instruction_info()
+    instruction_text()
+    low_level_il()
+    emulator_throughput()
+    emulator_call()
+    bank_mapping()
+    thread_safety()
+    import_time()
+    headless_batch()
+
+if __name__ == '__main__':
+    # `python -m` leaves registration to us, see __init__._headless
+    from . import register
+    register()
+    main()
@@ -1,11 +1,18 @@
-import traceback
-from binaryninja.architecture import Architecture
+import os, time, mmap, bisect, struct, traceback, contextlib
 from binaryninja.binaryview import BinaryView
 from binaryninja.types import Symbol
 from binaryninja.enums import SymbolType, SegmentFlag, Endianness
 from binaryninja.enums import SectionSemantics
-from binaryninja.log import log_info, log_error
-from . import mem
+from binaryninja.log import log_info, log_warn, log_error
+from . import mem, sfrs
+from .disassembler.specification import lazy_memoized_property
+from .architecture import MCS51
+from .experiments import bank_trampolines, jump_tables, calling_conventions
+from .experiments import analysis_cache
+
+# Parsing types is a round trip through the host's C parser, and these don't
+# change between views. :: {C declaration: Type}
+_types = {}
 
 class Family8051View(BinaryView):
     """
@@ -51,6 +58,22 @@ sz:  range:    dir   indir
     long_name = "Intel 8051 Family"
 
     xram_size = 0x10000  # initial assumption, override if desired
+    sfr_family = '8052'  # see sfrs.families
+
+    # Branches whose targets `seed_functions` adds as functions. Jumps are
+    # left out by default, most of them are just gotos inside a function.
+    seed_branches = ('lcall', 'acall')
+
+    # Flash banking geometry. Along with sfr_family, picks the view's
+    # architecture, see MCS51.variant.
+    bank_layout = mem.default_layout
+
+    # Resolve jmp @A+DPTR switch tables at load, see experiments.jump_tables.
+    resolve_jump_tables = True
+
+    # Reuse load-time analysis of pages seen before, see
+    # experiments.analysis_cache.
+    cache_analysis = True
 
     @classmethod
     def is_valid_for_data(self, data):
@@ -59,7 +82,7 @@ sz:  range:    dir   indir
         It's common to find chunks of 8051 firmware embedded in distant devices
         and memory spaces, with no context for what runs it or how it's loaded.
 
-        An .ihex loader/editor would be cool, but random carved .bin is likely.
+        Random carved .bin is likely; .hex/.srec go through devices.intel_hex.
         """
         # example at: https://github.com/adamcritchley/binjaarmbe8
         return False  # this class is meant to be extended, not used directly
@@ -90,10 +113,10 @@ sz:  range:    dir   indir
 
         # Provide nice markup for stuff like `pop 0h; pop 1h; pop 2h; pop 3h`
         # Sometimes, anyway. For some reason symbols aren't always created?
-        bank_t = self.platform.parse_types_from_source('''
+        bank_t = self.parse_type_cached('''
             struct register_bank __packed{uint8_t R[8];}; 
             /* register_bank bank[4]; */
-        ''').types['register_bank']
+        ''', 'register_bank')
         for index, ea in enumerate(range(mem.IRAM+0x00, mem.IRAM+0x20, 0x08)):
             name = 'RB%s' % (index,)
             self.define_auto_symbol(Symbol(SymbolType.DataSymbol, ea, name))
@@ -112,51 +135,221 @@ sz:  range:    dir   indir
         self.add_auto_segment(mem.XRAM, self.xram_size, 0, 0, rw)
         self.add_auto_section('.xram', mem.XRAM, self.xram_size, sem_rwd)
 
+    @lazy_memoized_property
+    def image(self):
+        """The unmodified parent as a read-only memoryview, mapped in once.
+
+        Only the file the parent was loaded from gets mapped, and only if it
+        hasn't changed on disk since this view was created. Databases, views
+        without a file and rewritten files are a single read of the parent
+        view instead. Either way, this stops being current once the parent is
+        modified, see `image_current`.
+        """
+        parent = self.parent_view
+        path = self.file.filename
+        original = getattr(self.file, 'original_filename', None)
+        try:
+            if ((not original or original == path) and
+                    os.path.getsize(path) == len(parent) and
+                    os.path.getmtime(path) <= self.created):
+                with open(path, 'rb') as f:
+                    return memoryview(mmap.mmap(f.fileno(), 0,
+                                                access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            pass
+        return memoryview(parent.read(0, len(parent)))
+
+    def image_current(self):
+        """Does `image` still match the parent? Not after patching it."""
+        return not getattr(self.parent_view, 'modified', False)
+
+    def add_code_segment(self, start, length, offset, flags, section=None):
+        """add_auto_segment for a chunk of the parent file, plus a section
+        if `section` is given a name. Data in these can be had with
+        code_bytes and read_words without going through self.read.
+        """
+        self.add_auto_segment(start, length, offset, length, flags)
+        if section:
+            self.add_auto_section(section, start, length,
+                    SectionSemantics.ReadOnlyCodeSectionSemantics)
+        bisect.insort(self.code_map, (start, length, offset))
+
+    def code_offset(self, start, length):
+        """-> file offset of [start, start+length) if one code segment holds
+        all of it, else None."""
+        i = bisect.bisect_right(self.code_map, (start, float('inf'))) - 1
+        if i < 0:
+            return None
+        seg_start, seg_length, offset = self.code_map[i]
+        if start + length > seg_start + seg_length:
+            return None
+        return offset + start - seg_start
+
+    def code_bytes(self, start, length):
+        """Zero-copy memoryview of loaded code, one bank or less at a time.
+
+        Anything not mapped by add_code_segment is read (and copied) the
+        slow way.
+        """
+        offset = self.code_offset(start, length)
+        if offset is None or not self.image_current():
+            return memoryview(self.read(start, length))
+        return self.image[offset:offset + length]
+
+    def code_segments(self):
+        """-> [(start, memoryview)] for every executable segment"""
+        return [(seg.start, self.code_bytes(seg.start, seg.end - seg.start))
+                for seg in self.segments if seg.executable]
+
+    def read_words(self, start, count, fmt='>H'):
+        """Up to `count` packed values at `start` with one unpack, e.g. a
+        table of big-endian code pointers. Fewer if the data runs out."""
+        size = struct.calcsize(fmt)
+        offset = self.code_offset(start, size * count)
+        if offset is None or not self.image_current():
+            data, offset = self.read(start, size * count), 0
+        else:
+            data = self.image
+        count = min(count, max(0, len(data) - offset) // size)
+        fmt = '%s%d%s' % (fmt[0], count, fmt[1:])
+        return struct.unpack_from(fmt, data, offset)
+
     def load_symbols(self):
-        """Names common special function registers."""
-        def sfr(addr, name, bit_addr_ok=0):
-            sym = Symbol(SymbolType.DataSymbol, mem.SFRs + addr, name)
-            self.define_auto_symbol(sym)
-            t = self.parse_type_string('uint8_t foo')[0]
+        """Names special function registers, see `sfrs`."""
+        db = sfrs.database(self.sfr_family)
+        t = self.parse_type_cached('uint8_t foo')
+        for addr, name in db:
+            self.define_auto_symbol(Symbol(SymbolType.DataSymbol,
+                                           mem.SFRs + addr, name))
             self.define_user_data_var(mem.SFRs + addr, t)
-        # TODO if this works parse it from an ASCII diagram
-        # or at least add comments
-
-        for ea in mem.regs:
-            sfr(ea - mem.SFRs, mem.regs[ea], 1)
-            # BinaryView can't add comments - huh?
-            # Well, so much for the plan of warning about inconsistent lack of
-            # xrefs. Magic, ho!
-            
-        ## TODO: this is probably worth piggybacking on top of mem.regs
-        #sfr(0xe0, 'A', 1)  # not ACC, that's stupid
-        #sfr(0xf0, 'B', 1)
-        sfr(0xd0, 'PSW', 1)
-        #sfr(0x81, 'SP')
-        #sfr(0x82, 'DPL'); sfr(0x83, 'DPH')
-        sfr(0x80, 'P0', 1); sfr(0x90, 'P1', 1)
-        sfr(0xa0, 'P2', 1); sfr(0xb0, 'P3', 1)
-        sfr(0xb8, 'IP', 1); sfr(0xa8, 'IE', 1)
-        sfr(0x89, 'TMOD')
-        sfr(0x88, 'TCON', 1)
-        sfr(0xc8, 'T2CON', 1) # 8052 only
-        sfr(0x8c, 'TH0'); sfr(0x8a, 'TL0')
-        sfr(0x8d, 'TH1'); sfr(0x8b, 'TL1')
-        # 8052 only:
-        sfr(0xcd, 'TH2'); sfr(0xcc, 'TL2')
-        sfr(0xcb, 'RCAP2H'); sfr(0xca, 'RCAP2L')
-        # back to 8051
-        sfr(0x98, 'SCON', 1)
-        sfr(0x99, 'SBUF')
-        sfr(0x87, 'PCON')
+
+    def seed_functions(self, names=None):
+        """Bulk add_function on branch targets from a linear sweep of every
+        executable segment. Returns how many were found.
+
+        Garbage in, garbage out: anything that sweeps through data will
+        produce spurious calls, so only use this on segments that are mostly
+        code.
+        """
+        try:
+            from .disassembler import sweep  # numpy isn't always around
+            import numpy as np
+        except ImportError as e:
+            log_error('Skipping function seeding: %s' % e)
+            return 0
+        names = names or self.seed_branches
+        code = [(start, start + len(data))
+                for start, data in self.code_segments()]
+        found = set()
+        for seeds in self.branch_targets(sweep):
+            targets = np.array([ea for name in names
+                                for ea in seeds.get(name, ())], np.int64)
+            for lo, hi in code:
+                hits = targets[(targets >= lo) & (targets < hi)]
+                found.update(hits.tolist())
+        for ea in sorted(found):
+            self.add_function(ea)
+        log_info('Seeded %d functions from %s' % (len(found), names))
+        return len(found)
+
+    def branch_targets(self, sweep):
+        """-> [{branch name: [targets]}] of every CODE page. Unchanged pages
+        replay theirs from the cache, so calls from them into changed pages
+        still get seeded. The rest are swept for every kind of branch, and
+        kept for the cache."""
+        swept = {}
+        pages = (self.code_segments() if self.pages is None
+                 else self.pages.unswept())
+        for start, data in pages:
+            at = sweep.starts(data)
+            swept[start] = {
+                name: sweep.branch_targets(data, start, (name,), at,
+                                           self.bank_layout)[0].tolist()
+                for name in sweep.CALLS + sweep.JUMPS}
+        if self.pages is None:
+            return list(swept.values())
+        self.pages.seeds = swept
+        return list(swept.values()) + self.pages.fields('seeds')
+
+    def find_bank_trampolines(self):
+        """Flash bank switching trampolines, and the stubs calling through
+        them, in all executable segments. See `bank_trampolines.scan`.
+        """
+        known = dict(self.cached('trampolines'))
+        banking = bank_trampolines.scan(self.uncached_segments(), known,
+                                        self.bank_layout)
+        banking.trampolines.update(known)
+        # Their trampolines may be on a changed page, so resolve them again.
+        stubs = [ea for ea, _, _ in self.cached('stubs')]
+        banking.stubs.update(bank_trampolines.recheck(
+            stubs, self.code_bytes, banking.trampolines, self.bank_layout))
+        log_info('Found %d bank trampolines, %d stubs calling them' %
+                 (len(banking.trampolines), len(banking.stubs)))
+        if banking.unmatched:
+            log_warn('%d stubs jump next to a bank trampoline but not into '
+                     'it, skipped: %s' % (len(banking.unmatched), ', '.join(
+                         '%#x->%#x' % hit for hit in
+                         sorted(banking.unmatched.items())[:8])))
+        return banking
+
+    def find_jump_tables(self):
+        """Targets of every jmp @A+DPTR whose switch idiom could be
+        emulated, in all executable segments. See `jump_tables.scan`.
+        """
+        segments = self.code_segments()
+        tables = jump_tables.scan(segments, self.uncached_segments(),
+                                  self.bank_layout)
+        # Emulate again where setup or targets reach into a changed page.
+        stale = []
+        for site, targets in self.cached('jump_tables'):
+            if (self.pages.changed(site - jump_tables.window, site) or
+                    any(self.pages.changed(t, t + 1) for t in targets)):
+                stale.append(site)
+            else:
+                tables[site] = targets
+        tables.update(jump_tables.resolve_all(segments, stale,
+                                              self.bank_layout))
+        log_info('Resolved %d jump tables, %d targets' %
+                 (len(tables), sum(map(len, tables.values()))))
+        return tables
+
+    def load_cache(self):
+        """Looks every CODE page up in the analysis cache. Functions and
+        names on unchanged pages come back right away, and the scans above
+        only cover pages that changed. Results for all pages are stored once
+        the first analysis finishes.
+        """
+        if not self.cache_analysis:
+            return
+        self.pages = analysis_cache.Pages(self)
+        self.pages.load()
+        for ea in self.pages.merged('functions'):
+            self.add_function(ea)
+        for ea, name in self.pages.merged('names'):
+            self.define_auto_symbol(
+                Symbol(SymbolType.FunctionSymbol, ea, name))
+        self.add_analysis_completion_event(self.pages.save)
+
+    def uncached_segments(self):
+        """code_segments, less the pages load_cache found."""
+        if self.pages is None:
+            return self.code_segments()
+        return self.pages.misses
+
+    def cached(self, field):
+        """One field of every cached page's record, see analysis_cache."""
+        return self.pages.merged(field) if self.pages else []
 
     def load_patches(self):
         """Insert patches into architecture internals here.
 
-        The default does nothing; you probably want to catch
-        AnalysisNotification events and insert patches via low-level hooks.
+        The default only hands resolved jump tables to analysis; you probably
+        want to catch AnalysisNotification events and insert patches via
+        low-level hooks.
         """
-        pass
+        if self.resolve_jump_tables:
+            self.jump_tables = jump_tables.register_hook(
+                self, self.find_jump_tables())
 
     def perform_get_entry_point(self):
         """Will need an override if booting from unknown ROM."""
@@ -166,27 +359,71 @@ sz:  range:    dir   indir
     def perform_is_executable(self):
         return True # eh sure
 
+    def parse_type_cached(self, source, name=None):
+        """parse_type_string(source), or the type called `name` out of a
+        parse_types_from_source(source). Parsed once per process."""
+        key = source, name
+        if key not in _types:
+            if name:
+                parsed = self.platform.parse_types_from_source(source)
+                _types[key] = parsed.types[name]
+            else:
+                _types[key] = self.parse_type_string(source)[0]
+        return _types[key]
+
+    @contextlib.contextmanager
+    def bulk_symbols(self):
+        """Batches up symbol definitions, where the host supports it."""
+        begin = getattr(self, 'begin_bulk_modify_symbols', None)
+        if begin is None:
+            yield
+            return
+        begin()
+        try:
+            yield
+        finally:
+            self.end_bulk_modify_symbols()
+
     def init(self):
         try:
-            self.load_memory()
-            self.load_symbols()
-            self.load_patches()
+            times = []
+            with self.bulk_symbols():
+                for step in (self.load_memory, self.load_cache,
+                             self.load_symbols, self.load_patches):
+                    start = time.time()
+                    step()
+                    times.append(time.time() - start)
+            log_info('%s loaded in %.3fs: memory %.3fs, cache %.3fs, '
+                     'symbols %.3fs, patches %.3fs' % ((self.name, sum(times)) + tuple(times)))
             return True
         except:
             log_error(traceback.format_exc())
             return False
 
-    def __init__(self, data):
-        BinaryView.__init__(self, parent_view=data, file_metadata=data.file)
+    def __init__(self, data, parent=None):
+        """parent: view to load segments from, if not `data` itself (say,
+        decoded from a file format)"""
+        BinaryView.__init__(self, parent_view=parent or data,
+                            file_metadata=data.file)
+        arch = MCS51.variant(self.bank_layout, self.sfr_family)
+        # Deferred until a view needs the platform, see lazy.
+        calling_conventions.register(arch)
         # not sure what this is for, copied from somewhere:
-        self.platform = Architecture['8051'].standalone_platform
+        self.platform = arch.standalone_platform
 
         # See https://github.com/Vector35/binaryninja-api/issues/645
         # This ensures endianness is propagated; not a huge deal.
         # While SFRs are arranged in LE order, compilers often store things in
         # BE order. May be worth having 8051-LE and 8051-BE archs in the
         # future.
-        self.arch = Architecture['8051']
+        self.arch = arch
+
+        # Bits of the parent file mapped by add_code_segment, sorted by
+        # address. :: [(start, length, file offset)]
+        self.code_map = []
+        self.created = time.time()  # files changed after this aren't mapped
+        # CODE pages and which were cached, if load_cache ran.
+        self.pages = None
 
         # Don't think this package uses them - leaving them for easy access
         # from REPL.
@@ -0,0 +1,8 @@
+# Profiles with a view class of their own :: {profile: class name}, the class
+# living in the module of the same name. The rest get a generic ProfileView.
+classes = {
+    'surface_ec': 'SurfaceECView',
+    'coastermelt': 'CoastermeltUSBView',
+    'inic_3609': 'Initio3609',
+    'vl811': 'VL811View',
+}
@@ -0,0 +1,219 @@
+"""Intel HEX and Motorola SREC images, banked or not.
+
+Banked toolchains (Keil BL51, SDCC) put each flash bank in its own 64K of
+linear address space, via extended address records:
+
+    linear 0x00000..0x0ffff   common area + bank 0, as the CPU sees it
+    linear 0x18000..0x1ffff   bank 1 window (0x8000..0xffff)
+    linear 0x28000..0x2ffff   bank 2 window
+    ...
+
+Bank windows get mapped the way `mem.flash_bank_virtual` expects, so banked
+branches resolve the same as with raw dumps. Copies of the common area in
+higher banks land on top of the bank 0 one. Wherever records overlap, the
+one later in the file wins. Segments are split at the common area and at
+every bank window, so no segment straddles two banks.
+
+Files are parsed a chunk of lines at a time, straight off the parent view.
+Checksums are checked in bulk per chunk.
+
+The decoded bytes live in a standalone view made with BinaryView.new, which
+becomes the parent of IntelHexView's segments. It has a FileMetadata of its
+own, not the file's: segments can only be backed by a view, the core offers
+no way to add decoded data to the file's own, and a second data view under
+the file's FileMetadata isn't something it expects. That's fine for saving
+and reopening, since the parent is derived state. A database stores the
+file's raw view (the HEX text) and the analysis. On reopen, __init__ runs on
+that raw view again and decodes the same bytes, so segments come back at
+the same addresses. Edits to CODE bytes land in the standalone parent,
+though, and are lost on reopen; patch the HEX text instead.
+"""
+import bisect
+from binaryninja.binaryview import BinaryView
+from binaryninja.enums import SegmentFlag
+from binaryninja.log import log_info, log_warn
+from .. import mem, probe
+from ..binaryview import Family8051View
+from ..disassembler.specification import lazy_memoized_property
+
+chunk_size = 1 << 20  # bytes of text per read from the parent view
+
+def lines(view, size=None):
+    """Stripped non-empty lines of a BinaryView, in chunks of about `size`
+    bytes. :: [[bytes]]"""
+    size = size or chunk_size
+    rest, offset, end = b'', 0, len(view)
+    while offset < end:
+        chunk = rest + view.read(offset, min(size, end - offset))
+        offset += size
+        chunk = chunk.split(b'\n')
+        rest = chunk.pop() if offset < end else b''
+        chunk = [line.strip() for line in chunk if line.strip()]
+        if chunk:
+            yield chunk
+
+# Address bytes per SREC record type
+_srec_addr = {0:2, 1:2, 2:3, 3:4, 5:2, 6:3, 7:4, 8:3, 9:2}
+
+def records(text):
+    """text: [bytes] lines of HEX or SREC
+
+    returns: ([decoded record], checksum residue), with residue 0 for HEX
+    and 0xff for SREC - what every record's bytes should sum to, mod 256.
+    """
+    try:
+        if text[0][:1] == b':':
+            return [bytes.fromhex(line[1:].decode()) for line in text], 0
+        return [bytes.fromhex(line[2:].decode()) for line in text], 0xff
+    except ValueError as e:
+        raise ValueError('Not a HEX/SREC line near %r: %s' % (text[0], e))
+
+def bad_checksums(recs, residue):
+    """Indices of records with a bad checksum, one vectorized pass."""
+    if not recs:
+        return []
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is None or not all(recs):  # empty ones are left for parse to flag
+        return [i for i, rec in enumerate(recs)
+                if rec and sum(rec) & 0xff != residue]
+    starts = np.cumsum([0] + [len(rec) for rec in recs[:-1]])
+    data = np.frombuffer(b''.join(recs), dtype=np.uint8).astype(np.uint32)
+    sums = np.add.reduceat(data, starts) & 0xff
+    return np.flatnonzero(sums != residue).tolist()
+
+def virtual(linear, layout=None):
+    """Linear address from the file, to our banked CODE address."""
+    layout = layout or mem.default_layout
+    bank, addr = divmod(linear, 0x10000)
+    return layout.virtual(addr, layout.bank_start(bank))
+
+def parse(view, layout=None):
+    """Reads a HEX or SREC BinaryView, banked according to `layout`
+    (mem.BankLayout, default mem.default_layout).
+
+    returns: (sorted [(CODE addr, bytes-like)] of coalesced runs, split at
+              bank boundaries, count of records with bad checksums)
+    """
+    layout = layout or mem.default_layout
+    runs = []  # :: [(start addr, bytearray)] in file order
+    base, bad, end = 0, 0, None
+    for text in lines(view):
+        srec = text[0][:1] == b'S'
+        recs, residue = records(text)
+        skip = set(bad_checksums(recs, residue))
+        bad += len(skip)
+        for i, (line, rec) in enumerate(zip(text, recs)):
+            if i in skip:
+                continue
+            if srec:
+                if not rec or rec[0] != len(rec) - 1:
+                    raise ValueError('Truncated SREC record %r' % line)
+                kind = int(line[1:2])
+                width = _srec_addr.get(kind)
+                if kind not in (1, 2, 3):
+                    continue  # header, counts, start address
+                addr = int.from_bytes(rec[1:1+width], 'big')
+                data = rec[1+width:-1]
+            else:
+                if len(rec) < 5 or len(rec) != rec[0] + 5:
+                    raise ValueError('Truncated HEX record %r' % line)
+                kind = rec[3]
+                if kind == 1:  # EOF
+                    return coalesce(runs, layout), bad
+                if kind == 2:  # extended segment address
+                    base = int.from_bytes(rec[4:6], 'big') << 4
+                elif kind == 4:  # extended linear address
+                    base = int.from_bytes(rec[4:6], 'big') << 16
+                if kind != 0:
+                    continue  # start addresses
+                addr = base + int.from_bytes(rec[1:3], 'big')
+                data = rec[4:-1]
+            addr = virtual(addr, layout)
+            if addr == end:  # carries on from the previous record, usually
+                runs[-1][1].extend(data)
+            else:
+                runs.append((addr, bytearray(data)))
+            end = addr + len(data)
+    return coalesce(runs, layout), bad
+
+def coalesce(runs, layout):
+    """Merge touching and overlapping [(start, bytearray)], given in file
+    order, so later runs land on top. Then split at bank boundaries."""
+    extents = []  # :: [[start, end]], sorted
+    for start, run in sorted(runs, key=lambda r: r[0]):
+        end = start + len(run)
+        if extents and start <= extents[-1][1]:
+            extents[-1][1] = max(extents[-1][1], end)
+        else:
+            extents.append([start, end])
+    starts = [start for start, _ in extents]
+    merged = [bytearray(end - start) for start, end in extents]
+    for start, run in runs:
+        i = bisect.bisect_right(starts, start) - 1
+        offset = start - starts[i]
+        merged[i][offset:offset + len(run)] = run
+    return [piece for start, data in zip(starts, merged)
+            for piece in split(start, memoryview(data), layout)]
+
+def split(start, data, layout):
+    """[(start, data)] pieces that each stay within one bank."""
+    pieces, end = [], start + len(data)
+    while start < end:
+        offset = start - mem.CODE
+        if offset < layout.common:
+            cut = layout.bank_start(0)
+        else:
+            cut = layout.bank_start(layout.bank_of(start) + 1)
+        cut = min(cut, end)
+        pieces.append((start, data[:cut - start]))
+        data, start = data[cut - start:], cut
+    return pieces
+
+
+class IntelHexView(Family8051View):
+    name = "8051 HEX"
+    long_name = "8051 Intel HEX/SREC image"
+
+    @classmethod
+    @probe.probing([(0, 0x40)])
+    def is_valid_for_data(self, data):
+        head = data.read(0, 0x40)
+        if head[:1] == b':':
+            return all(c in b'0123456789abcdefABCDEF\r\n:' for c in head)
+        if head[:1] == b'S' and head[1:2] in b'0123':
+            return all(c in b'0123456789abcdefABCDEF\r\nS' for c in head)
+        return False
+
+    def perform_get_entry_point(self):
+        return mem.CODE
+
+    def load_memory(self):
+        super().load_memory()
+        seg_f = SegmentFlag
+        r_xc = (seg_f.SegmentReadable | seg_f.SegmentExecutable |
+                seg_f.SegmentContainsCode)
+        offset = 0
+        for start, run in self.runs:
+            bank = self.bank_layout.bank_of(start)
+            name = '.bank%d' % bank if bank > 0 else '.code'
+            self.add_code_segment(start, len(run), offset, r_xc,
+                                  '%s_%x' % (name, start - mem.CODE))
+            offset += len(run)
+
+    def __init__(self, data):
+        self.runs, bad = parse(data, self.bank_layout)
+        if bad:
+            log_warn('%d HEX records with bad checksums skipped' % bad)
+        log_info('%d HEX segments, %d bytes' % (
+            len(self.runs), sum(len(run) for _, run in self.runs)))
+        self.blob = b''.join(run for _, run in self.runs)
+        # See the module docs for why the parent isn't part of data.file.
+        super().__init__(data, BinaryView.new(self.blob))
+
+    @lazy_memoized_property
+    def image(self):
+        """The decoded runs, which is all the parent holds."""
+        return memoryview(self.blob)
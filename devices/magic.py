@@ -0,0 +1,35 @@
+"""Profile JSON without the views: reading it and testing magic bytes.
+
+Kept free of BinaryView imports so `lazy` can register a stub per profile
+and check files against it before any device code is loaded. See profile.py
+for the JSON format.
+"""
+import os, json, glob
+
+profile_dir = os.path.join(os.path.dirname(__file__), 'profiles')
+
+def number(x):
+    """Ints or "0x..." strings"""
+    return int(x, 0) if isinstance(x, str) else x
+
+def check(m):
+    """One "magic" entry -> (offset, length, predicate on those bytes)"""
+    offset = number(m['offset'])
+    if 'contains' in m:
+        needle = m['contains'].encode(m.get('encoding', 'ascii'))
+        return offset, number(m['length']), lambda b: needle in b
+    if 'text' in m:
+        want = m['text'].encode(m.get('encoding', 'ascii'))
+    else:
+        want = bytes.fromhex(m['bytes'])
+    return offset, len(want), lambda b: b == want
+
+def spec(stem):
+    """Parsed devices/profiles/<stem>.json"""
+    with open(os.path.join(profile_dir, stem + '.json')) as f:
+        return json.load(f)
+
+def stems():
+    """Every profile, by JSON file name without the extension."""
+    return [os.path.splitext(os.path.basename(path))[0]
+            for path in sorted(glob.glob(os.path.join(profile_dir, '*.json')))]
@@ -0,0 +1,191 @@
+"""Device profiles: what a device-specific BinaryView needs, as data.
+
+Each devices/profiles/*.json describes one family of firmware images:
+
+    name, long_name   BinaryView type names
+    magic             [{offset, bytes (hex) | text [, encoding]}] or
+                      [{offset, length, contains}], all must match
+    entry_point       CODE address, defaults to the reset vector
+    xram_size         see Family8051View
+    sfr_family        see sfrs.families
+    segments          [{start, length, offset, flags, [section]}] of the file
+    banks             {start, size, count, offset, flags, [section], [symbol]}
+                      for flash pages laid out back to back in the file.
+                      The bank window is physical [start, start+size), see
+                      mem.BankLayout
+    functions         {name: CODE address}, ISR vectors mostly
+    sfrs              {name: SFR address} on top of the standard ones
+    jump_tables       [{address, count, entries, [symbol]}] of big-endian
+                      code pointers, `count` tables back to back
+
+A sfr_family or bank geometry other than Family8051View's gets the view an
+architecture of its own (see MCS51.variant), named after both. Databases
+record their architecture by name, so changing either in a profile renames
+the architecture existing databases were analyzed under.
+
+Numbers can be ints or "0x..." strings. Flags are "rwx" style, 'x' meaning
+executable code and 'd' data. Keys not listed (like "note") are ignored.
+
+Profiles with no Python class of their own get a generic ProfileView;
+devices with quirks subclass ProfileView and keep the code for those.
+"""
+from binaryninja.types import Symbol
+from binaryninja.enums import SymbolType, SegmentFlag
+from .. import mem
+from .. import probe
+from ..binaryview import Family8051View
+from . import magic
+
+_int = magic.number
+
+def _flags(text):
+    seg_f = SegmentFlag
+    flags = 0
+    if 'r' in text: flags |= seg_f.SegmentReadable
+    if 'w' in text: flags |= seg_f.SegmentWritable
+    if 'x' in text: flags |= seg_f.SegmentExecutable | seg_f.SegmentContainsCode
+    if 'd' in text: flags |= seg_f.SegmentContainsData
+    return flags
+
+class DeviceProfile:
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = spec['name']
+        self.long_name = spec.get('long_name', self.name)
+        self.magic = [magic.check(m) for m in spec['magic']]
+        self.entry_point = _int(spec.get('entry_point', 0))
+        self.xram_size = _int(spec.get('xram_size', Family8051View.xram_size))
+        self.sfr_family = spec.get('sfr_family', Family8051View.sfr_family)
+        self.segments = [dict(seg, start=_int(seg['start']),
+                              length=_int(seg['length']),
+                              offset=_int(seg['offset']),
+                              flags=_flags(seg['flags']))
+                         for seg in spec.get('segments', [])]
+        banks = spec.get('banks')
+        self.bank_layout = banks and mem.BankLayout(
+            _int(banks['start']), _int(banks['size']), banks['count'])
+        for page in range(banks['count'] if banks else 0):
+            size = _int(banks['size'])
+            self.segments.append({
+                'start': self.bank_layout.bank_start(page) - mem.CODE,
+                'length': size,
+                'offset': _int(banks['offset']) + size * page,
+                'flags': _flags(banks['flags']),
+                'section': banks['section'] % page if 'section' in banks else None,
+                'symbol': banks['symbol'] % page if 'symbol' in banks else None,
+            })
+        self.functions = {name: _int(ea)
+                          for name, ea in spec.get('functions', {}).items()}
+        self.sfrs = {name: _int(ea) for name, ea in spec.get('sfrs', {}).items()}
+        self.jump_tables = [dict(t, address=_int(t['address']))
+                            for t in spec.get('jump_tables', [])]
+
+    @classmethod
+    def load(cls, name):
+        return cls(magic.spec(name))
+
+    def matches(self, header):
+        """header: probe.Header, or anything else with read(offset, length)"""
+        return all(test(header.read(offset, length))
+                   for offset, length, test in self.magic)
+
+
+class Matcher:
+    """Every profile's magic checks, run once per file.
+
+    View selection asks each registered view in turn, so the verdict is kept
+    on the probe.Header for the rest of them.
+    """
+    def __init__(self):
+        self.profiles = []
+
+    def add(self, profile):
+        self.profiles.append(profile)
+        probe.regions.extend((offset, length)
+                             for offset, length, _ in profile.magic)
+
+    def match(self, header):
+        if 'profile' not in header.memo:
+            header.memo['profile'] = next(
+                (p for p in self.profiles if p.matches(header)), None)
+        return header.memo['profile']
+
+matcher = Matcher()
+
+
+class ProfileView(Family8051View):
+    """Loads whatever `profile` describes. Subclass per profile."""
+    profile = None
+
+    @classmethod
+    @probe.probing([])  # regions come from the profiles
+    def is_valid_for_data(self, data):
+        return self.profile is not None and matcher.match(data) is self.profile
+
+    def perform_get_entry_point(self):
+        return self.profile.entry_point
+
+    def load_memory(self):
+        super().load_memory()
+        self.load_profile_segments()
+
+    def load_profile_segments(self):
+        for seg in self.profile.segments:
+            self.add_code_segment(mem.CODE + seg['start'], seg['length'],
+                                  seg['offset'], seg['flags'],
+                                  seg.get('section'))
+            if seg.get('symbol'):
+                self.define_auto_symbol(Symbol(SymbolType.FunctionSymbol,
+                                        mem.CODE + seg['start'], seg['symbol']))
+                self.add_function(mem.CODE + seg['start'])
+
+    def load_symbols(self):
+        super().load_symbols()
+        t = self.parse_type_cached('uint8_t foo')
+        for name, ea in self.profile.sfrs.items():
+            self.define_auto_symbol(Symbol(SymbolType.DataSymbol,
+                                           mem.SFRs + ea, name))
+            self.define_user_data_var(mem.SFRs + ea, t)
+        for name, ea in self.profile.functions.items():
+            self.define_auto_symbol(Symbol(SymbolType.FunctionSymbol,
+                                           mem.CODE + ea, name))
+            self.add_function(mem.CODE + ea)
+        for table in self.profile.jump_tables:
+            self.load_jump_tables(**table)
+
+    def load_jump_tables(self, address, count, entries, symbol='jump_table_%d',
+                         **_):
+        """`count` tables of `entries` code pointers each, back to back."""
+        t = self.parse_type_cached('void*[%d]' % entries)
+        for i in range(count):
+            ea = mem.CODE + address + i * entries * 2
+            self.define_auto_symbol(Symbol(SymbolType.DataSymbol, ea,
+                                           symbol % i))
+            self.define_user_data_var(ea, t)
+            for fp in self.read_words(ea, entries):
+                self.add_function(mem.CODE + fp)
+
+def profiled(name):
+    """Class decorator, the ProfileView subclass loads
+    devices/profiles/<name>.json"""
+    def decorate(cls):
+        profile = DeviceProfile.load(name)
+        matcher.add(profile)
+        cls.profile = profile
+        cls.name, cls.long_name = profile.name, profile.long_name
+        cls.xram_size = profile.xram_size
+        cls.sfr_family = profile.sfr_family
+        if profile.bank_layout:
+            cls.bank_layout = profile.bank_layout
+        return cls
+    return decorate
+
+def generic_view(stem):
+    """ProfileView for profiles/<stem>.json, which has no class of its own."""
+    cls = type(ProfileView)(stem + '_view', (ProfileView,), {})
+    return profiled(stem)(cls)
+
+def generic_views(skip=()):
+    """ProfileViews for every profile not in `skip`, which is the names of
+    JSON files that have a view class of their own."""
+    return [generic_view(stem) for stem in magic.stems() if stem not in skip]
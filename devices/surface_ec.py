@@ -1,85 +1,32 @@
-import traceback
-from binaryninja.types import Symbol
-from binaryninja.enums import SymbolType, SegmentFlag, Endianness
-from binaryninja.enums import SectionSemantics
-from binaryninja.log import log_info, log_error
-from .. import mem
-from ..binaryview import Family8051View
 from ..experiments import llil_mangler
+from .profile import ProfileView, profiled
 
-class SurfaceECView(Family8051View):
-    name = "Surface EC"
-    long_name = "Surface EC WIP"
-
-    @classmethod
-    def is_valid_for_data(self, data):
-        if data.read(0xA1 + 8, 5) != b'\xa0\x03\x02\x01\x02':
-            return False  # first element, integer, version number
-        der_cert = data.read(0xA1, 1374)
-        return der_cert.find(b'Surface Firmware Signing') != -1
-
-    def perform_get_entry_point(self):
-        return 0x2000  # as long as it's not 0
-
-    def load_memory(self):
-        super().load_memory()
-
-        seg_f = SegmentFlag
-        rw_ = seg_f.SegmentReadable | seg_f.SegmentWritable
-        r_xc = (seg_f.SegmentReadable | seg_f.SegmentExecutable |
-                seg_f.SegmentContainsCode)
-        r__d = seg_f.SegmentReadable | seg_f.SegmentContainsData
-
-
-        image_base = 0x0182b  # probably signature before
-        # bootloader @ first 0x2000, then this stub
-        self.add_auto_segment(mem.CODE+0x2000, 0x6000, 
-                                       image_base, 0x6000, r_xc)
-        self.add_auto_section('.code', mem.CODE+0x2000, 0x6000, 
-                SectionSemantics.ReadOnlyCodeSectionSemantics)
-        for page in range(4):  # then 4 pages for high half of code
-            self.add_auto_segment(mem.CODE+0x8000 + 0x8000*page, 
-                    0x8000, image_base + 0x6000 + 0x8000 * page, 0x8000, r_xc)
-            self.add_auto_section('.page%d' % page, 
-                    mem.CODE+0x8000+0x8000*page, 0x8000,
-                    SectionSemantics.ReadOnlyCodeSectionSemantics)
-            self.define_auto_symbol(Symbol(SymbolType.FunctionSymbol, 
-                                    mem.CODE+0x8000+0x8000*page, 'page_%d' % page))
-            self.add_function(mem.CODE+0x8000*(page+1))
+@profiled('surface_ec')
+class SurfaceECView(ProfileView):
+    """Segments, pages and jump tables are in profiles/surface_ec.json, this
+    handles the flash banking."""
 
     def load_symbols(self):
         super().load_symbols()
-        # There's six sequential jump tables, used by functions that call
-        # jump_R1:2.
-        base = 0x45eb  # TODO pull from functions using them?
-        for i in range(6):
-            self.define_auto_symbol(Symbol(SymbolType.DataSymbol, 
-                                    mem.CODE+base, 'jump_table_'+str(i)))
-            self.define_user_data_var(mem.CODE+base,
-                    self.parse_type_string('void*[16]')[0])
-            for ea in range(base, base + 16 * 2, 2):
-                fp = int.from_bytes(self.read(ea, 2), 'big')
-                fp += mem.CODE
-                self.add_function(fp)
-            base += 16 * 2
 
-        # Flash bank swapping trampolines at 0x3500, refs to them between
-        # 0x3548 first one
-        # 0x3ff8 last one
-        # TODO: autodiscover this region with an instruction regex?
-        for ea in range(0x3548, 0x3ff8+6, 6):
-            if (self.read(ea, 1) != b'\x90' or
-                self.read(ea+3, 1) != b'\x02'):
-                msg = 'Bad instruction in trampoline jump at '+hex(ea)
-                raise RuntimeError(msg)
+        # Most functions in banks are lcall targets.
+        self.seed_functions()
+
+        # Flash bank swapping trampolines at 0x3500, stubs calling them from
+        # 0x3548 to 0x3ff8. Stubs are functions, and so are their targets.
+        self.banking = self.find_bank_trampolines()
+        for ea, (page, target) in self.banking.stubs.items():
             self.add_function(ea)
+            self.add_function(target)
 
     def load_patches(self):
         super().load_patches()
         # TODO move EC-specific hooks out of llil_mangler during refactor
+        mailbox = llil_mangler.registry(self)
+        mailbox.trampolines = self.banking.trampolines
+        # Patches from the last session, if this is a reopened database.
+        mailbox.restore()
 
     def __init__(self, data):
         super().__init__(data)
         llil_mangler.register_hook(self)
-
-SurfaceECView.register()
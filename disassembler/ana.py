@@ -1,5 +1,4 @@
 import re, struct
-from binaryninja.log import log_info
 from . import ana_op
 
 def operand_decoders(size, name, ops):
@@ -39,3 +39,28 @@ def bit(data, addr, size):
         return mem.IRAM + 0x20 + byte, bit
     else:
         return mem.SFRs + byte * 8, bit
+
+def specialize(decoder, layout):
+    """`decoder`, with `layout`'s bank mapping bound in if it's one of the
+    code address decoders above. Same results, without going through the
+    `mem` module globals on every call."""
+    make = {rel: _rel, addr16: _addr16, addr11: _addr11}.get(decoder)
+    return make(layout) if make else decoder
+
+def _rel(layout):
+    virtual, physical = layout.virtual, layout.physical
+    def rel(data, addr, size):
+        target = physical(addr) + size + (data[size-1] ^ 0x80) - 0x80
+        return virtual(target, addr)
+    return rel
+def _addr16(layout):
+    virtual = layout.virtual
+    def addr16(data, addr, size):
+        return virtual(data[1] << 8 | data[2], addr)
+    return addr16
+def _addr11(layout):
+    virtual, physical = layout.virtual, layout.physical
+    def addr11(data, addr, size):
+        target = (physical(addr) >> 11 << 11) + (data[0] >> 5 << 8) + data[1]
+        return virtual(target, addr)
+    return addr11
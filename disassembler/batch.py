@@ -0,0 +1,223 @@
+"""Recursive descent over raw images, without a BinaryView in sight.
+
+Meant for triage of carved blobs, where opening each one in the full host is
+the bottleneck. Uses the same refined tables as the architecture plugin, so
+listings should match what Binary Ninja shows, minus anything a BinaryView
+would add (symbols, SFR markup, LLIL patches).
+
+    python -m i8051.disassembler.batch [-j JOBS] [-f json|text] [-o OUTDIR]
+                                       [-e ENTRY] [--vectors] IMAGE|DIR ...
+
+Images are mapped at mem.CODE with file offset == address. Anything over 64K
+is treated as flash banks laid out the way `mem` expects.
+
+Nothing here touches binaryninja, so this runs where it isn't installed (or
+licensed). Text comes from plain-string renderers mirroring `out`, with
+SFR operands joined from the same sfrs.Operands parts (8052 names), and
+branches from `emu.branch_kind`.
+"""
+from __future__ import print_function
+import os, sys, json, enum, argparse
+from concurrent.futures import ProcessPoolExecutor
+from .. import mem, sfrs
+from . import specification, ana, emu
+
+# reset, then ext0, timer0, ext1, timer1, serial, timer2 (8052)
+VECTORS = [0x00, 0x03, 0x0b, 0x13, 0x1b, 0x23, 0x2b]
+
+# The host's BranchType names that emu.branch_kind uses.
+BT = enum.Enum('BranchType', 'UnconditionalBranch TrueBranch CallDestination '
+               'FunctionReturn UnresolvedBranch')
+
+def branch_type(size, name, ops):
+    size, branch = emu.branch_kind(size, name, ops)
+    return size, branch and (BT[branch[0]], branch[1])
+
+def hx(val): return hex(int(val))[2:] + 'h'  # same as out.hx
+
+def _joined(parts): return ''.join(text for _, text, _ in parts)
+
+_ops = sfrs.operands('8052')
+_direct = [_joined(parts) for parts in _ops.direct]
+_bits = [bits and [_joined(parts) for parts in bits] for bits in _ops.bits]
+
+def text_imm(val): return '#' + hx(val)
+def text_code(target): return hx(target - mem.CODE)
+def text_direct(target): return _direct[target & 0xff]
+
+def text_bit(target):
+    byte, bit = target
+    return _bits[byte & 0xff][bit]
+
+_renderers = {'#data': text_imm, 'code addr': text_code,
+              'data addr': text_direct, 'bit addr': text_bit}
+
+def text(size, name, operands):
+    """`out.tokens` as strings: (prefix, [(render_fn, value index, suffix)])
+    """
+    parts, index = [name + ' '], 0
+    for i, op in enumerate(operands):
+        if op.startswith(('@', '/')):
+            parts.append(op[0])
+            op = op[1:]
+        parts.append((_renderers[op], index) if op in _renderers else op)
+        if i + 1 < len(operands):
+            parts.append(', ')
+        if ana.needs_decoding(op):
+            index += 1
+    prefix, dynamic = '', []
+    for part in parts:
+        if isinstance(part, tuple):
+            dynamic.append([part[0], part[1], ''])
+        elif dynamic:
+            dynamic[-1][2] += part
+        else:
+            prefix += part
+    return prefix, [tuple(row) for row in dynamic]
+
+class Disassembler:
+    """Tables plus a recursive descent walk, no host API calls."""
+    def __init__(self):
+        spec = specification.InstructionSpec()
+        self.decoders = spec.refine(ana.operand_decoders)
+        self.text = spec.refine(text)
+        branches = spec.refine(branch_type)
+        self.info = [emu.fast_branch(code, *branches[code])
+                     for code in range(len(branches))]
+
+    def decode(self, image, addr):
+        """-> (size, operand values) or None past the end of image."""
+        offset = addr - mem.CODE
+        size, decoders = self.decoders[image[offset]]
+        data = image[offset:offset+size]
+        if len(data) < size:
+            return None
+        return size, [decoder(data, addr, size) for decoder in decoders]
+
+    def successors(self, image, addr, size):
+        """-> (flow targets, call targets), mirroring get_instruction_info"""
+        _, branch_type, target = self.info[image[addr - mem.CODE]]
+        if branch_type is None:
+            return [addr + size], []
+        if callable(target):
+            offset = addr - mem.CODE
+            target = target(image[offset:offset+size], addr)
+        if branch_type == BT.CallDestination:
+            return [addr + size], [target]
+        if branch_type == BT.TrueBranch:
+            return [target, addr + size], []
+        if branch_type == BT.UnconditionalBranch:
+            return [target], []
+        return [], []  # returns, jump tables
+
+    def explore(self, image, entries):
+        """-> ({addr: (size, vals)}, sorted function starts)"""
+        end = mem.CODE + len(image)
+        functions = set(entries)
+        todo = list(entries)
+        insns = {}
+        while todo:
+            addr = todo.pop()
+            if addr in insns or not mem.CODE <= addr < end:
+                continue
+            decoded = self.decode(image, addr)
+            if not decoded:
+                continue
+            insns[addr] = decoded
+            flow, calls = self.successors(image, addr, decoded[0])
+            for target in calls:
+                if mem.CODE <= target < end:
+                    functions.add(target)
+            todo += flow + calls
+        return insns, sorted(f for f in functions if f in insns)
+
+    def render(self, image, addr, vals):
+        prefix, dynamic = self.text[image[addr - mem.CODE]]
+        return (prefix + ''.join(render(vals[index]) + suffix
+                                 for render, index, suffix in dynamic)
+                ).rstrip()
+
+    def listing(self, image, entries):
+        insns, functions = self.explore(image, entries)
+        return {
+            'size': len(image),
+            'functions': functions,
+            'instructions': [
+                [addr, image[addr - mem.CODE:addr - mem.CODE + size].hex(),
+                 self.render(image, addr, vals)]
+                for addr, (size, vals) in sorted(insns.items())],
+        }
+
+def format_text(listing):
+    functions = set(listing['functions'])
+    lines = []
+    for addr, code, text in listing['instructions']:
+        if addr in functions:
+            lines.append('\nsub_%x:' % addr)
+        lines.append('%06x  %-6s  %s' % (addr, code, text))
+    return '\n'.join(lines).lstrip() + '\n'
+
+_worker = None
+
+def disassemble_file(path, entries, fmt):
+    """Process pool entry point, tables get built once per worker."""
+    global _worker
+    if _worker is None:
+        _worker = Disassembler()
+    with open(path, 'rb') as f:
+        image = f.read()
+    entries = [mem.CODE + e for e in entries if e < len(image)]
+    listing = _worker.listing(image, entries)
+    listing['image'] = path
+    if fmt == 'json':
+        return json.dumps(listing)
+    return format_text(listing)
+
+def images(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name)):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    p.add_argument('paths', nargs='+', help='raw images, or dirs of them')
+    p.add_argument('-f', '--format', choices=['json', 'text'], default='text')
+    p.add_argument('-o', '--outdir', help='one listing per image, else stdout')
+    p.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
+    p.add_argument('-e', '--entry', action='append', default=[],
+                   type=lambda x: int(x, 0), help='code entry point')
+    p.add_argument('--vectors', action='store_true',
+                   help='also start from 8052 interrupt vectors')
+    args = p.parse_args(argv)
+    os.environ['I8051_HEADLESS'] = '1'  # workers skip host registration
+
+    entries = args.entry or [0]
+    if args.vectors:
+        entries = sorted(set(entries + VECTORS))
+    paths = list(images(args.paths))
+    ext = '.json' if args.format == 'json' else '.lst'
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+
+    with ProcessPoolExecutor(args.jobs) as pool:
+        jobs = [pool.submit(disassemble_file, path, entries, args.format)
+                for path in paths]
+        for path, job in zip(paths, jobs):
+            try:
+                listing = job.result()
+            except Exception as e:
+                print('%s: %r' % (path, e), file=sys.stderr)
+                continue
+            if args.outdir:
+                name = os.path.basename(path) + ext
+                with open(os.path.join(args.outdir, name), 'w') as f:
+                    f.write(listing)
+            else:
+                print(listing)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
 import re
-from binaryninja.enums import BranchType as BT
 from . import ana_op
+from .. import mem
+from ..mem import CODE
 
-def branch_type(size, name, _):
+def branch_type(size, name, ops):
     """Everything needed for get_instruction_info(..)
 
     (..) -> [(size, branch)]
@@ -10,23 +11,94 @@ def branch_type(size, name, _):
         branch :: None | (BranchType, target_parser | 0)
         target_parser :: (code, addr, size) -> ea
     """
+    # Imported here so branch_kind works without the host, see batch.
+    from binaryninja.enums import BranchType
+    size, branch = branch_kind(size, name, ops)
+    return size, branch and (BranchType[branch[0]], branch[1])
+
+def branch_kind(size, name, _):
+    """branch_type, with BranchType member names instead of members."""
     if re.match('cjne|djnz|jbc|jn?[bcz]$', name):
         # All branches are signed relative on the last byte.
         # (There may be a decrement-me byte in the middle.) 
-        return size, (BT.TrueBranch, ana_op.rel)
+        return size, ('TrueBranch', ana_op.rel)
 
     return size, {
-        'sjmp': (BT.UnconditionalBranch, ana_op.rel),
-        'ajmp': (BT.UnconditionalBranch, ana_op.addr11),
-        'ljmp': (BT.UnconditionalBranch, ana_op.addr16),
-        # @A+DPTR, another jump table sign
-        'jmp': (BT.UnresolvedBranch, 0),
+        'sjmp': ('UnconditionalBranch', ana_op.rel),
+        'ajmp': ('UnconditionalBranch', ana_op.addr11),
+        'ljmp': ('UnconditionalBranch', ana_op.addr16),
+        # @A+DPTR, another jump table sign; see experiments.jump_tables
+        'jmp': ('UnresolvedBranch', 0),
         # TODO watch for targets that POP DPL; POP DPH
-        'acall': (BT.CallDestination, ana_op.addr11),
-        'lcall': (BT.CallDestination, ana_op.addr16),
-        'ret': (BT.FunctionReturn, 0),
-        'reti': (BT.FunctionReturn, 0),
+        'acall': ('CallDestination', ana_op.addr11),
+        'lcall': ('CallDestination', ana_op.addr16),
+        'ret': ('FunctionReturn', 0),
+        'reti': ('FunctionReturn', 0),
         # Going to handle 'reserved' as a silent return until I figure out
         # TODO the right way to flag unimpl. instruction for manual review.
-        'reserved': (BT.FunctionReturn, 0),
+        'reserved': ('FunctionReturn', 0),
     }.get(name, None)
+
+def fast_branch(code, size, branch, layout=None):
+    """Specialize a `branch_type` row into a flat dispatch entry.
+
+    (code, size, branch) -> (size, BranchType | None, target_fn | ea)
+      where
+        target_fn :: (code, addr) -> ea
+
+    Target functions have the flash banking arithmetic for `layout`
+    (mem.BankLayout, default mem.default_layout) inlined, so
+    get_instruction_info(..) doesn't bounce through `ana_op` and `mem` for
+    every branch seen during linear sweep. Must stay equivalent to the
+    `ana_op` decoders they replace.
+    """
+    if not branch:
+        return size, None, 0
+    branch_type, target = branch
+    if not callable(target):
+        return size, branch_type, target
+    return size, branch_type, {
+        ana_op.rel: _rel_target,
+        ana_op.addr11: _addr11_target,
+        ana_op.addr16: _addr16_target,
+    }[target](code, size, layout or mem.default_layout)
+
+def _rel_target(code, size, layout):
+    last, next_pc = size - 1, size
+    common, bank, base = layout.common, layout.bank_size, layout.base
+    window_end, shift = layout.window_end, layout.shift
+    def target(data, addr):
+        phys = addr - CODE
+        banked = phys >= base
+        if banked:
+            phys = common + (phys - base) % bank  # flash_bank_physical
+        target = phys + next_pc + (data[last] ^ 0x80) - 0x80
+        if banked and common <= target < window_end:  # flash_bank_virtual
+            target += (addr - CODE - base) // bank * bank + shift
+        return target + CODE
+    return target
+
+def _addr11_target(code, size, layout):
+    opcode_steal = code >> 5 << 8
+    common, bank, base = layout.common, layout.bank_size, layout.base
+    window_end, shift = layout.window_end, layout.shift
+    def target(data, addr):
+        phys = addr - CODE
+        banked = phys >= base
+        if banked:
+            phys = common + (phys - base) % bank
+        target = (phys >> 11 << 11) + opcode_steal + data[1]
+        if banked and common <= target < window_end:
+            target += (addr - CODE - base) // bank * bank + shift
+        return target + CODE
+    return target
+
+def _addr16_target(code, size, layout):
+    common, bank, base = layout.common, layout.bank_size, layout.base
+    window_end, shift = layout.window_end, layout.shift
+    def target(data, addr):
+        target = data[1] << 8 | data[2]
+        if addr - CODE >= base and common <= target < window_end:
+            target += (addr - CODE - base) // bank * bank + shift
+        return target + CODE
+    return target
@@ -1,26 +1,49 @@
 from binaryninja.enums import InstructionTextTokenType as TTT
 from binaryninja.function import InstructionTextToken as TT
-from .. import mem
+from .. import mem, sfrs
 from .ana import needs_decoding
 
-def render(row, vals):
+def render(row, vals, names):
     """Fill in dynamic portions that aren't precomputed.
 
-    :: [[TT | (render_fn, decode_val_index)]] -> [val] -> [TT]
+    :: ([TT], [(render_fn, decode_val_index, [TT])]) -> [val] -> SfrNames
+       -> [TT]
+
+    Rows without operands to decode are returned as-is (a shared tuple once
+    Tables is built), so callers must treat the result as read-only.
+    """
+    toks, dynamic = row
+    if not dynamic:
+        return toks
+    toks = list(toks)
+    for mapper, index, static in dynamic:
+        toks += mapper(vals[index], names)
+        toks += static
+    return toks
+
+def compile_row(toks):
+    """Flatten `tokens` output into a static prefix, then a list of operand
+    renderers, each followed by the static tokens up to the next one.
+
+    :: [[TT] | (render_fn, decode_val_index)] -> ([TT], [(..., [TT])])
     """
-    def remap(val):
-        if type(val) != tuple:
-            return val
+    prefix, dynamic = [], []
+    static = prefix
+    for tok in toks:
+        if type(tok) == tuple:
+            static = []
+            dynamic.append(tok + (static,))
         else:
-            mapper,index = val
-            return mapper(vals[index])
-            
-    return sum([remap(tok) for tok in row], [])
+            static += tok
+    return prefix, dynamic
 
-def tokens(_, name, operands):
-    """Everything needed for get_instruction_text(..)
+def tokens(size, name, operands):
+    """Everything needed for get_instruction_text(..), see `render`."""
+    return compile_row(_tokens(size, name, operands))
 
-    :: (..) -> [[TT | (render_fn, decoded_operand_index)]]
+def _tokens(_, name, operands):
+    """
+    :: (..) -> [[TT] | (render_fn, decoded_operand_index)]
     """
     toks = [[TT(TTT.InstructionToken, name), 
              TT(TTT.OperandSeparatorToken, ' ')]]
@@ -60,54 +83,83 @@ def tokens(_, name, operands):
 
     return toks
 
+def memoized(f):
+    """Rendered operands are read-only, so repeat values can share tokens.
+
+    Only for operands with a small value range: SFRs, bits, 8-bit immediates.
+    """
+    cache = {}
+    def lookup(val):
+        try:
+            return cache[val]
+        except KeyError:
+            toks = cache[val] = f(val)
+            return toks
+    lookup.cache = cache
+    lookup.__name__ = f.__name__
+    lookup.__doc__ = f.__doc__
+    return lookup
+
 def hx(val):
     #return hex(int(val))  # just hex please
     #return hex(int(val))[2:].upper() + 'H'  # shouty manual style
     return hex(int(val))[2:] + 'h'  # not-shouty, but still deadbeefh
 
-def out_code(target):
+def out_code(target, names):
     return [TT(TTT.PossibleAddressToken, hx(target - mem.CODE),
                                          value=target, size=2)]
 
-def out_direct(target):
-    if target in mem.regs:  
-        # for special memory-mapped registers, render them as proper regs
-        if mem.regs[target] == 'A':
-            # lol assembler roundtrip
-            return [TT(TTT.RegisterToken, 'A'), TT(TTT.TextToken, 'CC')]
-        return [TT(TTT.RegisterToken, mem.regs[target])]
-    else:
-        unmapped = target - mem.IRAM
-        if unmapped < 0 or unmapped > 0x80:
-            unmapped = target - mem.SFRs
-        return [TT(TTT.PossibleAddressToken, hx(unmapped),
-                                             value=target, size=1)]
-
-def out_imm(val):
+def out_direct(target, names):
+    return names.direct[target & 0xff]
+
+def out_imm(val, names):
+    # 16-bit immediates are mostly unique DPTR loads, not worth keeping
+    return _out_imm8(val) if val < 0x100 else _out_imm(val)
+
+def _out_imm(val):
     return [TT(TTT.TextToken, '#'), TT(TTT.IntegerToken, hx(val), value=val)]
+_out_imm8 = memoized(_out_imm)
 
-def out_bit(target):
+def out_bit(target, names):
     """This deviates from standard assembler syntax, I think. 
     
     I'm not sure if the BYTE_ADDR.BIT_ADDR notation used in IDA is used
     elsewhere.
     """
     byte,bit = target
-    if byte == mem.PSW and bit in mem.flags:
-        # Treat memory-mapped flag access as an actual flag.
-        # This won't be sound for code that reads PSW then does manual
-        # bitshifts to extract flags, but oh well. :(
-        return [TT(TTT.RegisterToken, mem.flags[bit])]
-    else:
-        if byte not in mem.regs:
-            unmapped = byte - mem.IRAM
-            if unmapped < 0 or unmapped >= 0x80:
-                unmapped = byte - mem.SFRs
-            unmapped = hx(unmapped)
-            return [TT(TTT.PossibleAddressToken, unmapped, value=byte, size=1),
-                    TT(TTT.TextToken, '.'), # hmm, non-std syntax? :|
-                    TT(TTT.IntegerToken, str(bit), value=bit)]
+    return names.bits[byte & 0xff][bit]
+
+def _out_parts(parts):
+    """sfrs.Operands parts -> [TT]"""
+    toks = []
+    for kind, text, value in parts:
+        if kind == 'address':
+            toks.append(TT(TTT.PossibleAddressToken, text, value=value,
+                           size=1))
+        elif kind == 'integer':
+            toks.append(TT(TTT.IntegerToken, text, value=value))
         else:
-            return [TT(TTT.RegisterToken, mem.regs[byte]),
-                    TT(TTT.TextToken, '.'),
-                    TT(TTT.IntegerToken, str(bit), value=bit)]
+            toks.append(TT({'register': TTT.RegisterToken,
+                            'text': TTT.TextToken}[kind], text))
+    return toks
+
+class SfrNames:
+    """Rendered direct and bit operands for one SFR family, as tokens made
+    from sfrs.Operands. Prebuilt for every address ana_op can produce, so
+    rendering is just indexing.
+
+    Each architecture instance renders with its own, see MCS51.variant.
+    """
+    def __init__(self, family):
+        ops = sfrs.operands(family)
+        self.direct = [_out_parts(parts) for parts in ops.direct]
+        self.bits = [bits and [_out_parts(parts) for parts in bits]
+                     for bits in ops.bits]
+
+_names = {}
+
+def sfr_names(family):
+    """SfrNames for an sfrs family, built once."""
+    if family not in _names:
+        _names[family] = SfrNames(family)
+    return _names[family]
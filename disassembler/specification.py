@@ -12,6 +12,7 @@ semantic specs because the latter had minor errors. (Incrementing PC by 2 on a
 3 byte instruction due to copy-pasted spec, etc.) They're also super-tedious to
 scrape.
 """
+import threading
 
 class InstructionSpec:
     """Assembly and machine code produced by 1-byte opcode dispatch.
@@ -46,11 +47,26 @@ refine(self, f(size, name, [operand]) -> A) -> [A]*256
             self.spec.append([size, name.lower(), operands.split(', ')])
 
 class lazy_memoized_property:
-    """Decorator replaces a @property with its return value on first use."""
-    def __init__(self, getter): self.getter = getter
+    """Decorator replaces a @property with its return value on first use.
+
+    The host calls into architectures from several analysis threads, so the
+    first use is locked: other threads wait for the one running the getter
+    instead of running it again. After that, reads are plain attribute
+    lookups that never see the lock. It's shared by every instance, and
+    reentrant so a getter can use the same property on another instance.
+    """
+    def __init__(self, getter):
+        self.getter = getter
+        self.lock = threading.RLock()
     def __get__(self, host, host_class):
-        val = self.getter(host)
-        setattr(host, self.getter.__name__, val)
+        if host is None:
+            return self
+        name = self.getter.__name__
+        with self.lock:
+            if name in vars(host):  # another thread got here first
+                return vars(host)[name]
+            val = self.getter(host)
+            setattr(host, name, val)
         return val
 
 # Hex Code | Number of Bytes | Mnemonic | Operands
@@ -67,7 +83,7 @@ def _table_text():
 08	1	INC	R0
 09	1	INC	R1
 0A	1	INC	R2
-0B	1	INC	R2
+0B	1	INC	R3
 0C	1	INC	R4
 0D	1	INC	R5
 0E	1	INC	R6
@@ -307,7 +323,7 @@ EF	1	MOV	A, R7
 F0	1	MOVX	@DPTR, A
 F1	2	ACALL	code addr
 F2	1	MOVX	@R0, A
-F3	1	MOVX	@R0, A
+F3	1	MOVX	@R1, A
 F4	1	CPL	A
 F5	2	MOV	data addr, A
 F6	1	MOV	@R0, A
@@ -0,0 +1,85 @@
+"""Whole-segment linear sweep, vectorized with NumPy.
+
+Recursive descent in the host only finds what's reachable from known entry
+points, and banked images hide most of their code behind trampolines. A
+cheap linear sweep over every CODE segment finds the bulk of call targets up
+front, so they can be seeded as functions in one go.
+
+Sweeping is inherently sequential (each instruction start depends on the
+previous length) but the chain can still be followed with pointer doubling:
+log2(instruction count) rounds of array indexing instead of a Python loop.
+
+Like the rest of `disassembler`, this knows nothing about BinaryViews; feed it
+bytes and the address they're mapped at.
+"""
+import numpy as np
+from .. import mem
+from . import specification
+
+CALLS = ('lcall', 'acall')
+JUMPS = ('ljmp', 'ajmp')
+
+_spec = specification.InstructionSpec().spec
+SIZES = np.array([size for size, _, _ in _spec], dtype=np.int64)
+
+def opcodes(names):
+    """-> bool[256] mask of opcodes for the given mnemonics"""
+    return np.array([name in names for _, name, _ in _spec])
+
+def lengths(code):
+    """Per-byte length of the instruction that would start there."""
+    return SIZES[np.frombuffer(code, dtype=np.uint8)]
+
+def starts(code, entry=0):
+    """Bitmap of instruction starts reached by linear sweep from `entry`."""
+    n = len(code)
+    # next[i] is where the instruction at i ends, n is a sink for overruns
+    jump = np.minimum(np.arange(n + 1) + np.append(lengths(code), 0), n)
+    marked = np.zeros(n + 1, dtype=bool)
+    chain = np.array([entry])
+    marked[chain] = True
+    # chain holds next^t(entry) for t < 2^k; jump is next^(2^k)
+    while True:
+        more = jump[chain]
+        more = more[more < n]
+        if not len(more):
+            break
+        marked[more] = True
+        chain = np.concatenate([chain, more])
+        jump = jump[jump]
+    return marked[:n]
+
+def branch_targets(code, base=mem.CODE, names=CALLS + JUMPS, at=None,
+                   layout=None):
+    """Targets of absolute calls and jumps, mapped like `ana_op` does.
+
+    code: bytes of one CODE segment
+    base: our virtual address of code[0]
+    names: which of lcall/ljmp/acall/ajmp to collect
+    at: instruction start bitmap, defaults to a sweep from code[0]
+    layout: mem.BankLayout, defaults to mem.default_layout
+    returns: (sorted unique targets, addresses of the branches)
+    """
+    layout = layout or mem.default_layout
+    op = np.frombuffer(code, dtype=np.uint8).astype(np.int64)
+    n = len(op)
+    at = starts(code) if at is None else at
+    where = np.flatnonzero(at & opcodes(names)[op])
+    where = where[where + SIZES[op[where]] <= n]  # truncated at the end
+    addr = base + where
+    b1 = op[np.minimum(where + 1, n - 1)]
+    b2 = op[np.minimum(where + 2, n - 1)]
+
+    phys = addr - mem.CODE  # flash_bank_physical
+    from_base = phys - layout.base
+    in_bank = from_base >= 0
+    phys = np.where(in_bank, layout.common + from_base % layout.bank_size,
+                    phys)
+    long_ = SIZES[op[where]] == 3
+    target = np.where(long_, b1 << 8 | b2,
+                      (phys >> 11 << 11) + (op[where] >> 5 << 8) + b1)
+    banked = in_bank & (target >= layout.common) & (  # flash_bank_virtual
+        target < layout.window_end)
+    target = np.where(banked, target + from_base // layout.bank_size *
+                      layout.bank_size + layout.shift, target) + mem.CODE
+    return np.unique(target), addr
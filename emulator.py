@@ -0,0 +1,479 @@
+"""Instruction set emulator, no Binary Ninja analysis involved.
+
+For triage jobs that are easier to run than to read: decrypting string
+tables, walking jump tables, checking what a helper returns. It's driven by
+the same spec and operand decoders as the disassembler, so it shares its
+view of operands and of flash banking (see `mem.BankLayout`).
+
+Memory is a few bytearrays:
+
+    d      0x000..0x0ff  IRAM as seen by @Ri and the stack
+           0x100..0x1ff  SFRs, direct addresses 0x80..0xff at 0x180..
+    xram   64K, movx
+    code   the image, indexed by our virtual CODE address (banks and all)
+
+Direct operands are resolved to an index into `d` once per instruction
+address, along with everything else decoded, so steady-state execution is
+a dict lookup plus one handler call per instruction.
+
+Not modelled: peripherals, interrupts, timing, and the PSW parity bit.
+Code is assumed not to change under us, since it can't on real hardware.
+"""
+from . import mem
+from .disassembler import specification, ana, ana_op
+
+# Indices into Machine.d
+SFR = 0x100
+ACC, B, PSW, SP, DPL, DPH, P2 = (SFR + 0xe0, SFR + 0xf0, SFR + 0xd0,
+                                 SFR + 0x81, SFR + 0x82, SFR + 0x83,
+                                 SFR + 0xa0)
+CY, AC, OV = 0x80, 0x40, 0x04
+
+class Fault(Exception):
+    """Emulation can't continue, e.g. reserved opcode or running off the
+    end of code."""
+
+
+class Machine:
+    def __init__(self, code, xram=None, layout=None):
+        """code: bytes-like CODE image, offset 0 is mem.CODE
+        layout: mem.BankLayout the image is banked by, default
+                mem.default_layout"""
+        self.code = code
+        self.layout = layout or mem.default_layout
+        self.decoders = decoders(self.layout)
+        self.d = bytearray(0x200)
+        self.xram = xram if xram is not None else bytearray(0x10000)
+        self.decoded = {}  # :: {pc: (handler, operand values, next pc)}
+        self.steps = 0
+        self.reset()
+
+    def reset(self, pc=mem.CODE):
+        """Registers and IRAM back to zero, keeping XRAM and decoded code."""
+        self.d[:] = bytes(0x200)
+        self.d[SP] = 0x07  # reset value
+        self.pc = pc
+
+    # Plain accessors, for setting up a run and reading results.
+    a = property(lambda self: self.d[ACC],
+                 lambda self, x: self.d.__setitem__(ACC, x))
+    b = property(lambda self: self.d[B],
+                 lambda self, x: self.d.__setitem__(B, x))
+    psw = property(lambda self: self.d[PSW],
+                   lambda self, x: self.d.__setitem__(PSW, x))
+    sp = property(lambda self: self.d[SP],
+                  lambda self, x: self.d.__setitem__(SP, x))
+
+    @property
+    def dptr(self): return self.d[DPH] << 8 | self.d[DPL]
+    @dptr.setter
+    def dptr(self, x): self.d[DPH], self.d[DPL] = x >> 8 & 0xff, x & 0xff
+
+    def r(self, n):
+        return self.d[(self.d[PSW] & 0x18) + n]
+
+    def set_r(self, n, x):
+        self.d[(self.d[PSW] & 0x18) + n] = x
+
+    def direct(self, addr):
+        """Value at a direct address, 0..0x7f IRAM, 0x80..0xff SFRs."""
+        return self.d[_direct(addr)]
+
+    def set_direct(self, addr, x):
+        self.d[_direct(addr)] = x
+
+    def decode(self, pc):
+        code = self.code[pc - mem.CODE]
+        size, decoders = self.decoders[code]
+        data = self.code[pc - mem.CODE:pc - mem.CODE + size]
+        if len(data) < size:
+            raise Fault('Truncated instruction at %x' % pc)
+        vals = iter([decode(data, pc, size) for decode in decoders])
+        ops = tuple(conv(next(vals)) if conv else 0
+                    for conv in _operands[code])
+        return _handlers[code], ops, pc + size
+
+    def run(self, steps=1 << 20, stop=None):
+        """Execute until `steps` instructions ran or pc hits `stop`.
+
+        returns: instructions executed
+        """
+        decoded, pc = self.decoded, self.pc
+        count = 0
+        try:
+            while count < steps and pc != stop:
+                try:
+                    handler, ops, nxt = decoded[pc]
+                except KeyError:
+                    handler, ops, nxt = decoded[pc] = self.decode(pc)
+                pc = handler(self, ops, nxt)
+                count += 1
+        except IndexError:
+            raise Fault('Ran off the end of code at %x' % pc)
+        finally:
+            self.pc = pc
+            self.steps += count
+        return count
+
+    def step(self):
+        return self.run(1)
+
+    def call(self, addr, steps=1 << 24):
+        """Call `addr` as a subroutine, returning once it does.
+
+        The return address is the current pc, which had better be in the
+        common area or the same bank as `addr`.
+        """
+        ret, sp = self.pc, self.d[SP]
+        _push16(self, self.layout.physical(ret))
+        self.pc = addr
+        count = 0
+        while count < steps:
+            count += self.run(steps - count, stop=ret)
+            if self.pc != ret:
+                break  # out of steps
+            if self.d[SP] == sp:
+                return count
+            # At `ret` but deeper in the stack, e.g. calling the function
+            # we're in, so run through it.
+            count += self.step()
+        raise Fault('No return from %x in %d steps' % (addr, steps))
+
+
+def _direct(addr):
+    return addr if addr < 0x80 else SFR + addr
+
+def _direct_operand(flat):
+    return _direct(flat & 0xff)
+
+def _bit_operand(flat):
+    byte, bit = flat
+    return _direct(byte & 0xff), 1 << bit
+
+def _push16(m, val):
+    d = m.d
+    d[SP] = sp = d[SP] + 1 & 0xff
+    d[sp] = val & 0xff
+    d[SP] = sp = sp + 1 & 0xff
+    d[sp] = val >> 8
+
+def _pop16(m):
+    d = m.d
+    sp = d[SP]
+    val = d[sp] << 8 | d[sp - 1 & 0xff]
+    d[SP] = sp - 2 & 0xff
+    return val
+
+def _set_flags(d, cy, ac, ov):
+    d[PSW] = d[PSW] & 0x3b | cy << 7 | ac << 6 | ov << 2
+
+
+def reader(kind):
+    """Operand read for `kind`, :: (Machine, operand value) -> int"""
+    if kind == 'A':
+        return lambda m, v: m.d[ACC]
+    if kind in ('R0', 'R1', 'R2', 'R3', 'R4', 'R5', 'R6', 'R7'):
+        n = int(kind[1])
+        return lambda m, v: m.d[(m.d[PSW] & 0x18) + n]
+    if kind in ('@R0', '@R1'):
+        n = int(kind[2])
+        def read_indirect(m, v):
+            d = m.d
+            return d[d[(d[PSW] & 0x18) + n]]
+        return read_indirect
+    if kind == 'data addr':
+        return lambda m, v: m.d[v]
+    if kind == '#data':
+        return lambda m, v: v
+    if kind == 'bit addr':
+        return lambda m, v: 1 if m.d[v[0]] & v[1] else 0
+    if kind == '/bit addr':
+        return lambda m, v: 0 if m.d[v[0]] & v[1] else 1
+    if kind == 'C':
+        return lambda m, v: m.d[PSW] >> 7
+    if kind == 'DPTR':
+        return lambda m, v: m.d[DPH] << 8 | m.d[DPL]
+    return None
+
+def writer(kind):
+    """Operand write for `kind`, :: (Machine, operand value, int) -> None"""
+    if kind == 'A':
+        return lambda m, v, x: m.d.__setitem__(ACC, x)
+    if kind in ('R0', 'R1', 'R2', 'R3', 'R4', 'R5', 'R6', 'R7'):
+        n = int(kind[1])
+        def write_reg(m, v, x):
+            d = m.d
+            d[(d[PSW] & 0x18) + n] = x
+        return write_reg
+    if kind in ('@R0', '@R1'):
+        n = int(kind[2])
+        def write_indirect(m, v, x):
+            d = m.d
+            d[d[(d[PSW] & 0x18) + n]] = x
+        return write_indirect
+    if kind == 'data addr':
+        return lambda m, v, x: m.d.__setitem__(v, x)
+    if kind == 'bit addr':
+        def write_bit(m, v, x):
+            d = m.d
+            d[v[0]] = d[v[0]] | v[1] if x else d[v[0]] & ~v[1]
+        return write_bit
+    if kind == 'C':
+        def write_carry(m, v, x):
+            d = m.d
+            d[PSW] = d[PSW] | CY if x else d[PSW] & ~CY
+        return write_carry
+    if kind == 'DPTR':
+        def write_dptr(m, v, x):
+            d = m.d
+            d[DPH], d[DPL] = x >> 8 & 0xff, x & 0xff
+        return write_dptr
+    return None
+
+
+def semantics(size, name, ops):
+    """Handler for one opcode, :: (Machine, operand values, next pc) -> pc
+
+    Operand values are per operand position, 0 where nothing was decoded.
+    """
+    rd = [reader(op) for op in ops] + [None]
+    wr = [writer(op) for op in ops] + [None]
+    r0, r1, w0, w1 = rd[0], rd[1], wr[0], wr[1]
+
+    def nop(m, vs, nxt):
+        return nxt
+    def reserved(m, vs, nxt):
+        raise Fault('Reserved opcode a5 at %x' % (nxt - 1))
+
+    def ajmp(m, vs, nxt):
+        return vs[0]
+    ljmp = sjmp = ajmp
+    def acall(m, vs, nxt):
+        _push16(m, m.layout.physical(nxt))
+        return vs[0]
+    lcall = acall
+    def ret(m, vs, nxt):
+        return m.layout.virtual(_pop16(m), nxt)
+    reti = ret
+    def jmp(m, vs, nxt):  # @A+DPTR
+        d = m.d
+        target = (d[DPH] << 8 | d[DPL]) + d[ACC] & 0xffff
+        return m.layout.virtual(target, nxt)
+
+    def jc(m, vs, nxt):
+        return vs[0] if m.d[PSW] & CY else nxt
+    def jnc(m, vs, nxt):
+        return nxt if m.d[PSW] & CY else vs[0]
+    def jz(m, vs, nxt):
+        return nxt if m.d[ACC] else vs[0]
+    def jnz(m, vs, nxt):
+        return vs[0] if m.d[ACC] else nxt
+    def jb(m, vs, nxt):
+        byte, mask = vs[0]
+        return vs[1] if m.d[byte] & mask else nxt
+    def jnb(m, vs, nxt):
+        byte, mask = vs[0]
+        return nxt if m.d[byte] & mask else vs[1]
+    def jbc(m, vs, nxt):
+        byte, mask = vs[0]
+        d = m.d
+        if d[byte] & mask:
+            d[byte] &= ~mask
+            return vs[1]
+        return nxt
+
+    def djnz(m, vs, nxt):
+        x = r0(m, vs[0]) - 1 & 0xff
+        w0(m, vs[0], x)
+        return vs[-1] if x else nxt
+    def cjne(m, vs, nxt):
+        a, b = r0(m, vs[0]), r1(m, vs[1])
+        m.d[PSW] = m.d[PSW] | CY if a < b else m.d[PSW] & ~CY
+        return vs[2] if a != b else nxt
+
+    def mov(m, vs, nxt):
+        w0(m, vs[0], r1(m, vs[1]))
+        return nxt
+    if name == 'mov' and ops == ['data addr', 'A']:
+        def mov(m, vs, nxt):  # the usual spill
+            m.d[vs[0]] = m.d[ACC]
+            return nxt
+    elif name == 'mov' and ops == ['A', 'data addr']:
+        def mov(m, vs, nxt):
+            m.d[ACC] = m.d[vs[1]]
+            return nxt
+    def push(m, vs, nxt):
+        d = m.d
+        d[SP] = sp = d[SP] + 1 & 0xff
+        d[sp] = d[vs[0]]
+        return nxt
+    def pop(m, vs, nxt):
+        d = m.d
+        sp = d[SP]
+        d[vs[0]] = d[sp]
+        d[SP] = sp - 1 & 0xff
+        return nxt
+    def xch(m, vs, nxt):
+        a, x = r0(m, vs[0]), r1(m, vs[1])
+        w0(m, vs[0], x)
+        w1(m, vs[1], a)
+        return nxt
+    def xchd(m, vs, nxt):
+        a, x = r0(m, vs[0]), r1(m, vs[1])
+        w0(m, vs[0], a & 0xf0 | x & 0x0f)
+        w1(m, vs[1], x & 0xf0 | a & 0x0f)
+        return nxt
+
+    pc_relative = ops[-1] == '@A+PC'
+    def movc(m, vs, nxt):
+        d = m.d
+        if pc_relative:
+            base = m.layout.physical(nxt)
+        else:
+            base = d[DPH] << 8 | d[DPL]
+        target = m.layout.virtual(base + d[ACC] & 0xffff, nxt)
+        d[ACC] = m.code[target - mem.CODE]
+        return nxt
+    load = ops[0] == 'A'
+    ptr = ops[-1] if load else ops[0]
+    ri = int(ptr[2]) if ptr in ('@R0', '@R1') else None
+    def movx(m, vs, nxt):
+        d = m.d
+        if ri is None:
+            addr = d[DPH] << 8 | d[DPL]
+        else:  # @Ri, high byte from P2 like most parts do
+            addr = d[P2] << 8 | d[(d[PSW] & 0x18) + ri]
+        if load:
+            d[ACC] = m.xram[addr]
+        else:
+            m.xram[addr] = d[ACC]
+        return nxt
+
+    def inc(m, vs, nxt):
+        w0(m, vs[0], r0(m, vs[0]) + 1 & 0xff)
+        return nxt
+    def dec(m, vs, nxt):
+        w0(m, vs[0], r0(m, vs[0]) - 1 & 0xff)
+        return nxt
+    if name == 'inc' and ops == ['DPTR']:
+        def inc(m, vs, nxt):
+            d = m.d
+            x = (d[DPH] << 8 | d[DPL]) + 1
+            d[DPH], d[DPL] = x >> 8 & 0xff, x & 0xff
+            return nxt
+
+    def add(m, vs, nxt, carry=0):
+        d = m.d
+        a, b = d[ACC], r1(m, vs[1])
+        c = d[PSW] >> 7 if carry else 0
+        r = a + b + c
+        d[ACC] = r & 0xff
+        _set_flags(d, r > 0xff, (a & 0xf) + (b & 0xf) + c > 0xf,
+                   (~(a ^ b) & (a ^ r) & 0x80) != 0)
+        return nxt
+    def addc(m, vs, nxt):
+        return add(m, vs, nxt, 1)
+    def subb(m, vs, nxt):
+        d = m.d
+        a, b = d[ACC], r1(m, vs[1])
+        c = d[PSW] >> 7
+        r = a - b - c
+        d[ACC] = r & 0xff
+        _set_flags(d, r < 0, (a & 0xf) - (b & 0xf) - c < 0,
+                   ((a ^ b) & (a ^ r) & 0x80) != 0)
+        return nxt
+    def anl(m, vs, nxt):
+        w0(m, vs[0], r0(m, vs[0]) & r1(m, vs[1]))
+        return nxt
+    def orl(m, vs, nxt):
+        w0(m, vs[0], r0(m, vs[0]) | r1(m, vs[1]))
+        return nxt
+    def xrl(m, vs, nxt):
+        w0(m, vs[0], r0(m, vs[0]) ^ r1(m, vs[1]))
+        return nxt
+    def mul(m, vs, nxt):
+        d = m.d
+        r = d[ACC] * d[B]
+        d[ACC], d[B] = r & 0xff, r >> 8
+        _set_flags(d, 0, d[PSW] >> 6 & 1, r > 0xff)
+        return nxt
+    def div(m, vs, nxt):
+        d = m.d
+        if d[B] == 0:
+            _set_flags(d, 0, d[PSW] >> 6 & 1, 1)
+        else:
+            d[ACC], d[B] = divmod(d[ACC], d[B])
+            _set_flags(d, 0, d[PSW] >> 6 & 1, 0)
+        return nxt
+    def da(m, vs, nxt):
+        d = m.d
+        a, psw = d[ACC], d[PSW]
+        if a & 0xf > 9 or psw & AC:
+            a += 6
+        if a >> 4 > 9 or psw & CY or a > 0xff:
+            a += 0x60
+        if a > 0xff:
+            d[PSW] = psw | CY
+        d[ACC] = a & 0xff
+        return nxt
+
+    def clr(m, vs, nxt):
+        w0(m, vs[0], 0)
+        return nxt
+    def setb(m, vs, nxt):
+        w0(m, vs[0], 1)
+        return nxt
+    def cpl(m, vs, nxt):
+        if ops[0] == 'A':
+            m.d[ACC] ^= 0xff
+        else:
+            w0(m, vs[0], not r0(m, vs[0]))
+        return nxt
+    def swap(m, vs, nxt):
+        a = m.d[ACC]
+        m.d[ACC] = a << 4 & 0xf0 | a >> 4
+        return nxt
+    def rl(m, vs, nxt):
+        a = m.d[ACC]
+        m.d[ACC] = a << 1 & 0xff | a >> 7
+        return nxt
+    def rr(m, vs, nxt):
+        a = m.d[ACC]
+        m.d[ACC] = a >> 1 | a << 7 & 0x80
+        return nxt
+    def rlc(m, vs, nxt):
+        d = m.d
+        a, psw = d[ACC], d[PSW]
+        d[ACC] = a << 1 & 0xff | psw >> 7
+        d[PSW] = psw & ~CY | a & CY
+        return nxt
+    def rrc(m, vs, nxt):
+        d = m.d
+        a, psw = d[ACC], d[PSW]
+        d[ACC] = a >> 1 | psw & CY
+        d[PSW] = psw & ~CY | a << 7 & CY
+        return nxt
+
+    return locals()[name]
+
+_spec = specification.InstructionSpec()
+_decoders = _spec.refine(ana.operand_decoders)
+_handlers = _spec.refine(semantics)
+# Per opcode, per operand position: converter for its decoded value, or None
+# for operands implied by the opcode.
+_operands = _spec.refine(lambda size, name, ops: [
+    {'data addr': _direct_operand,
+     'bit addr': _bit_operand,
+     '/bit addr': _bit_operand}.get(op, int) if ana.needs_decoding(op)
+    else None for op in ops])
+
+_specialized = {}  # :: {BankLayout: decoders}
+
+def decoders(layout):
+    """`_decoders` with `layout`'s bank mapping bound in, shared between
+    machines."""
+    if layout not in _specialized:
+        _specialized[layout] = [
+            (size, [ana_op.specialize(d, layout) for d in ds])
+            for size, ds in _decoders]
+    return _specialized[layout]
@@ -0,0 +1,186 @@
+"""Remembers load-time analysis per page of CODE, across images and sessions.
+
+Firmware updates mostly ship the same banks as the last release with one or
+two rebuilt. Sweeping for functions, emulating jump tables and matching
+trampolines on all of them again is wasted work, so results get stored in a
+SQLite file in the user directory, keyed by a hash of each page's bytes.
+Pages are code segments split at bank boundaries (see `pages`), and the key
+also covers where the page is mapped and the bank layout, since every
+banked address in a record depends on both.
+
+Per page, a record holds:
+
+    functions    starts of functions, as of the first full analysis
+    names        [(addr, name)] auto names of functions not named sub_*;
+                 user names belong to one image, so they stay out
+    seeds        {branch name: [targets]} from sweeping the page, or None
+                 if no view swept it yet, see Family8051View.branch_targets
+    jump_tables  [(jmp @A+DPTR addr, [targets])], see jump_tables.scan
+    trampolines  [(addr, page)], see bank_trampolines.scan
+    stubs        [(addr, page, target)]
+
+Addresses are absolute, and everything is plain JSON so records don't depend
+on this package's internals. Results read code outside the page (a jump
+table's setup can straddle a boundary, stubs need trampolines found
+elsewhere), so a changed page can stale a neighbour's record. The view
+checks those against changed pages (see `Pages.changed`) and redoes them.
+Bump `version` if a scanner changes what it finds.
+"""
+import os, json, sqlite3, hashlib
+import binaryninja
+from binaryninja.log import log_info, log_warn
+from .. import mem
+
+version = 2
+fields = 'functions', 'names', 'seeds', 'jump_tables', 'trampolines', 'stubs'
+
+def default_path():
+    user = getattr(binaryninja, 'user_directory', None)
+    root = user() if user else os.path.expanduser('~/.binaryninja')
+    return os.path.join(root, 'i8051_analysis.sqlite')
+
+def pages(segments, layout):
+    """Splits [(start, data)] at the common area and every bank window."""
+    cuts = [layout.bank_start(bank) for bank in range(layout.count + 1)]
+    out = []
+    for start, data in segments:
+        end = start + len(data)
+        points = sorted({start, end} | {c for c in cuts if start < c < end})
+        out += [(lo, data[lo - start:hi - start])
+                for lo, hi in zip(points, points[1:])]
+    return out
+
+def page_key(layout, start, data):
+    h = hashlib.sha256(('%d %r %#x ' % (version, layout, start)).encode())
+    h.update(data)
+    return h.hexdigest()
+
+class AnalysisCache:
+    """One SQLite file of page records. Connections are opened per call, so
+    this can be used from whichever thread analysis callbacks run on."""
+    def __init__(self, path=None):
+        self.path = path or default_path()
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute('CREATE TABLE IF NOT EXISTS pages '
+                   '(key TEXT PRIMARY KEY, record TEXT NOT NULL)')
+        return db
+
+    def get(self, keys):
+        """-> {key: record} for the keys that are cached, in one query per
+        few hundred keys (SQLite limits bound parameters)"""
+        keys, found = list(keys), {}
+        with self.connect() as db:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = db.execute(
+                    'SELECT key, record FROM pages WHERE key IN (%s)' %
+                    ','.join('?' * len(chunk)), chunk)
+                found.update((key, json.loads(rec)) for key, rec in rows)
+        return found
+
+    def put(self, records):
+        """records: {key: record}, written in one transaction"""
+        with self.connect() as db:
+            db.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?)',
+                           [(key, json.dumps(rec, separators=(',', ':')))
+                            for key, rec in records.items()])
+
+
+class Pages:
+    """A view's CODE pages and which of them were cached.
+
+    After `load`, `hits` maps page start to its cached record and `misses`
+    lists the (start, data) pages that need the full treatment. The view
+    merges the two as it goes, and `save` stores the view's results for
+    every page once its first analysis finishes.
+    """
+    def __init__(self, bv, cache=None):
+        self.bv = bv
+        self.cache = cache or AnalysisCache()
+        self.layout = bv.bank_layout
+        self.pages = pages(bv.code_segments(), self.layout)
+        self.keys = {start: page_key(self.layout, start, data)
+                     for start, data in self.pages}
+        self.hits = {}
+        self.misses = self.pages
+        self.seeds = {}  # :: {page start: seeds} for misses, see records
+
+    def load(self):
+        try:
+            found = self.cache.get(self.keys.values())
+        except (sqlite3.Error, OSError, ValueError) as e:
+            log_warn('Analysis cache unavailable: %s' % e)
+            return
+        self.hits = {start: found[key] for start, key in self.keys.items()
+                     if key in found}
+        self.misses = [(start, data) for start, data in self.pages
+                       if start not in self.hits]
+        log_info('Analysis cache: %d of %d pages unchanged' %
+                 (len(self.hits), len(self.pages)))
+
+    def merged(self, field):
+        """Every hit's `field` entries, chained."""
+        return [entry for rec in self.hits.values() for entry in rec[field]]
+
+    def fields(self, field):
+        """Every hit's `field`, as is, where it's set."""
+        return [rec[field] for rec in self.hits.values()
+                if rec[field] is not None]
+
+    def unswept(self):
+        """(start, data) of pages with no seeds cached."""
+        return [(start, data) for start, data in self.pages
+                if self.hits.get(start, {}).get('seeds') is None]
+
+    def changed(self, lo, hi):
+        """Whether [lo, hi) overlaps a page that wasn't cached."""
+        return any(start < hi and lo < start + len(data)
+                   for start, data in self.misses)
+
+    def page_of(self, addr):
+        """Start of the page holding addr, or None."""
+        for start, data in self.pages:
+            if start <= addr < start + len(data):
+                return start
+        return None
+
+    def records(self):
+        """-> {key: record} from the view's current state"""
+        bv = self.bv
+        recs = {start: {field: [] for field in fields}
+                for start, _ in self.pages}
+        for start, rec in recs.items():
+            # Sweep results, not view state: carried over for hits.
+            rec['seeds'] = self.seeds.get(
+                start, self.hits.get(start, {}).get('seeds'))
+        def into(addr, field, entry):
+            start = self.page_of(addr)
+            if start is not None:
+                recs[start][field].append(entry)
+        for func in bv.functions:
+            into(func.start, 'functions', func.start)
+            sym = func.symbol
+            if sym.auto and not sym.name.startswith('sub_'):
+                into(func.start, 'names', (func.start, sym.name))
+        tables = getattr(bv, 'jump_tables', None)
+        for site, targets in getattr(tables, 'tables', {}).items():
+            into(site, 'jump_tables', (site, targets))
+        banking = getattr(bv, 'banking', None)
+        if banking is not None:
+            for ea, page in banking.trampolines.items():
+                into(ea, 'trampolines', (ea, page))
+            for ea, (page, target) in banking.stubs.items():
+                into(ea, 'stubs', (ea, page, target))
+        return {self.keys[start]: rec for start, rec in recs.items()}
+
+    def save(self):
+        try:
+            recs = self.records()
+            self.cache.put(recs)
+        except (sqlite3.Error, OSError) as e:
+            log_warn('Analysis cache not saved: %s' % e)
+            return
+        log_info('Analysis cache: saved %d pages' % len(recs))
@@ -0,0 +1,143 @@
+"""Finds flash bank switching trampolines by byte pattern.
+
+Banked compiler output calls across banks through a small trampoline per
+bank: stash the target (already in DPTR) on the stack as a return address,
+flip some port bits to switch banks, then `ret` into the target. Callers go
+through 6-byte stubs that load DPTR and jump to the right trampoline. From the
+Surface EC, page 0:
+
+    c0 08        push 08h
+    74 35        mov A, #35h
+    c0 e0        push ACC
+    c0 82        push DPL
+    c0 83        push DPH
+    75 08 0a     mov 08h, #0Ah
+    c2 90        clr P1.0        <- bank select bits, page 0
+    c2 91        clr P1.1
+    22           ret
+
+    90 xx xx     mov DPTR, #target
+    02 35 00     ljmp page_0_trampoline
+
+Both are found by compiled regexes (automata over the byte alternatives,
+same idea as Aho-Corasick), one pass each over every segment. Matching isn't
+instruction-aligned, so the patterns are lookaheads: every offset gets tried,
+and a spurious match can't swallow a real one. Trampolines are matched from
+the push of DPL, since the setup before it is too loose to say where they
+start. That comes from the stubs instead: a stub's ljmp target is anchored if
+only setup instructions lie between it and a trampoline body, and only
+anchored stubs count. Stubs jumping just short of (or into) a trampoline that
+don't anchor are reported as `unmatched`, since those are probably real
+stubs missed.
+"""
+import re, bisect
+from collections import namedtuple
+from .. import mem
+
+Banking = namedtuple('Banking', 'trampolines stubs unmatched',
+                     defaults=((),))
+# trampolines :: {addr: page}
+# stubs :: {addr: (page, banked target addr)}
+# unmatched :: {addr: virtual ljmp target}, stubs that look like near misses
+
+_setup = rb'(?:\xc0.|\x74.|\x75..)'  # push direct, mov A,#, mov direct,#
+_port_bit = rb'[\xc2\xd2][\x80-\x87\x90-\x97\xa0-\xa7\xb0-\xb7]'  # clr/setb
+_max_setup = 6  # setup instructions allowed before push DPL
+_max_lead = 3 * _max_setup  # bytes of them
+_lead = re.compile(_setup + rb'{0,%d}' % _max_setup, re.DOTALL)
+_body = re.compile(
+    rb'(?=(?P<body>\xc0\x82\xc0\x83' +  # push DPL, push DPH: return address
+        _setup + rb'*'
+        rb'(?P<bits>(?:' + _port_bit + rb')+)'
+    rb'\x22))',  # ret
+    re.DOTALL)
+_stub = re.compile(rb'(?=\x90(?P<dptr>..)\x02(?P<via>..))',  # mov DPTR,#; ljmp
+                   re.DOTALL)
+
+def page_of(bits):
+    """Bank number from clr/setb pairs, lowest port bit first."""
+    ops = sorted((bits[i+1], bits[i]) for i in range(0, len(bits), 2))
+    return sum((op == 0xd2) << n for n, (_, op) in enumerate(ops))
+
+def scan(segments, known=None, layout=None):
+    """segments: [(start addr, bytes)] of CODE, scanned in one pass each
+    known: {addr: page} of trampolines found earlier, outside `segments`
+    layout: mem.BankLayout of the image, default mem.default_layout
+
+    returns: Banking, of what's in `segments`
+    """
+    layout = layout or mem.default_layout
+    bodies = {}  # :: {push DPL addr: (page, end, segment start, data)}
+    calls = {}  # :: {stub addr: (virtual ljmp target, dptr)}
+    for start, data in segments:
+        for m in _body.finditer(data):
+            bodies[start + m.start()] = (page_of(m.group('bits')),
+                                         start + m.end('body'), start, data)
+        for m in _stub.finditer(data):
+            ea = start + m.start()
+            via = int.from_bytes(m.group('via'), 'big')
+            calls[ea] = (layout.virtual(via, ea),
+                         int.from_bytes(m.group('dptr'), 'big'))
+    order = sorted(bodies)
+
+    def anchor(via):
+        """-> push DPL addr of the trampoline starting at `via`, or None"""
+        i = bisect.bisect_left(order, via)
+        if i == len(order) or order[i] - via > _max_lead:
+            return None
+        _, _, start, data = bodies[order[i]]
+        if via < start or not _lead.fullmatch(data, via - start,
+                                              order[i] - start):
+            return None
+        return order[i]
+
+    def near(via):
+        """Is `via` just before, or inside, a trampoline?"""
+        i = bisect.bisect_right(order, via + _max_lead) - 1
+        return i >= 0 and via < bodies[order[i]][1]
+
+    known = dict(known or {})
+    trampolines, anchored, unmatched = {}, set(), {}
+    for ea, (via, _) in calls.items():
+        if via in known or via in trampolines:
+            continue
+        body = anchor(via)
+        if body is not None:
+            trampolines[via] = bodies[body][0]
+            anchored.add(body)
+        elif near(via):
+            unmatched[ea] = via
+    for body in set(order) - anchored:
+        # Nothing jumps here, so take the earliest start the setup allows.
+        _, _, start, data = bodies[body]
+        lead = next(ea for ea in range(max(start, body - _max_lead), body + 1)
+                    if _lead.fullmatch(data, ea - start, body - start))
+        trampolines[lead] = bodies[body][0]
+    known.update(trampolines)
+    stubs = {ea: (known[via], layout.virtual(
+                      dptr, layout.bank_start(known[via])))
+             for ea, (via, dptr) in calls.items() if via in known}
+    return Banking(trampolines, stubs, unmatched)
+
+def recheck(stubs, read, trampolines, layout=None):
+    """Stubs found by an earlier scan, resolved again against
+    `trampolines`: the one a stub jumps to can have moved, or changed page,
+    if the code around it changed since.
+
+    stubs: addresses of stubs
+    read: (addr, length) -> bytes-like of CODE
+    returns: {addr: (page, banked target addr)} of stubs still calling one
+    """
+    layout = layout or mem.default_layout
+    found = {}
+    for ea in stubs:
+        m = _stub.match(bytes(read(ea, 6)))
+        if m is None:
+            continue
+        via = layout.virtual(int.from_bytes(m.group('via'), 'big'), ea)
+        if via in trampolines:
+            page = trampolines[via]
+            found[ea] = (page, layout.virtual(
+                int.from_bytes(m.group('dptr'), 'big'),
+                layout.bank_start(page)))
+    return found
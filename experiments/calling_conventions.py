@@ -5,6 +5,7 @@ but let's give it a go and see what binja does.
 Good overview of compiler differences: 
     http://www.bound-t.com/doc-archive/an-8051-v2.pdf
 """
+import threading
 from binaryninja.callingconvention import CallingConvention
 
 class YoloCall(CallingConvention):
@@ -46,3 +47,21 @@ class IARCall(CallingConvention):
     # DPTR might also be calee-saved
     caller_saved_regs = (['B', 'A'] +  'R0 R1 R2 R3 R4 R5'.split())
 
+
+_registered = set()  # architecture names
+_lock = threading.Lock()
+
+def register(arch):
+    """Registers the conventions above on `arch`, and makes yolo the
+    standalone platform's default. Only the first call does anything, so it's
+    safe to call from wherever the platform first gets used."""
+    with _lock:
+        if arch.name in _registered:
+            return
+        _registered.add(arch.name)
+        for cls in [SDCCCall, KeilCall, IARCall, YoloCall]:
+            arch.register_calling_convention(cls(arch, cls.name))
+        # experimental, not sure how useful it is yet
+        yolo_cc = YoloCall(arch, YoloCall.name)
+        arch.standalone_platform.default_calling_convention = yolo_cc
+        arch.standalone_platform.system_calling_convention = yolo_cc
@@ -0,0 +1,216 @@
+"""Resolves `jmp @A+DPTR` jump tables by emulating the code in front of them.
+
+Switch statements compile to a bounds check on A, some scaling, a table base
+in DPTR and an indirect jump. Either the table is a run of ajmp/ljmp
+instructions jumped into directly:
+
+    cjne  A, #5, $+3     <- guard: A < 5, or the jnc below leaves
+    jnc   default
+    mov   A, R7
+    add   A, ACC
+    add   A, R7          <- 3 bytes per ljmp
+    mov   DPTR, #table
+    jmp   @A+DPTR
+
+or a table of code pointers read with movc, then jumped to with A (or DPTR)
+holding the rest. Either way the guard says how many cases there are, so
+running the setup once per case in `emulator` gets every target without
+caring which idiom it was. `anl A, #mask` and `add A, #k; jc` guards work too.
+
+Anything that doesn't load DPTR with a table address, or doesn't reach the
+jump from every case within a few steps, is left unresolved rather than
+guessed at. Like bank_trampolines, scanning only
+needs CODE bytes; `register_hook` feeds the results to analysis.
+"""
+import bisect, inspect, threading
+from binaryninja import BinaryDataNotification
+from .. import mem, emulator
+from ..disassembler import specification
+
+window = 24      # bytes searched back from the jump for its setup code
+max_steps = 32   # per case, guard to jump
+max_cases = 256
+
+_spec = specification.InstructionSpec().spec
+# Setup ends at anything that doesn't fall through (calls included, they may
+# clobber A), so what's left is straight-line code up to the jump.
+_stops = {'ret', 'reti', 'ljmp', 'ajmp', 'sjmp', 'jmp', 'lcall', 'acall',
+          'reserved'}
+_sources = {0xe5} | set(range(0xe8, 0xf0))  # mov A, direct | Rn
+
+class Code:
+    """CODE segments as one bytes-like thing indexed by our virtual address,
+    which is what emulator.Machine wants. Unmapped reads raise IndexError,
+    same as running off the end of bytes."""
+    def __init__(self, segments):
+        self.segments = sorted(segments, key=lambda seg: seg[0])
+        self.starts = [start - mem.CODE for start, _ in self.segments]
+
+    def find(self, offset):
+        i = bisect.bisect_right(self.starts, offset) - 1
+        if i < 0 or offset >= self.starts[i] + len(self.segments[i][1]):
+            raise IndexError(offset)
+        return self.starts[i], self.segments[i][1]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, data = self.find(key.start)
+            return bytes(data[key.start - start:key.stop - start])
+        start, data = self.find(key)
+        return data[key - start]
+
+def setup(code, site):
+    """Straight-line instruction addresses leading up to `site`, decoded
+    from the furthest start within `window` that lands on it exactly."""
+    for s in range(site - window, site):
+        addrs, ea = [], s
+        try:
+            while ea < site:
+                addrs.append(ea)
+                if _spec[code[ea - mem.CODE]][1] in _stops:
+                    addrs = []
+                ea += _spec[code[ea - mem.CODE]][0]
+        except IndexError:
+            continue
+        if ea == site:
+            return addrs
+    return []
+
+def guard(code, addrs):
+    """-> (index into addrs of the guard, how many cases it lets through),
+    the guard nearest the jump, or None"""
+    for i in reversed(range(len(addrs))):
+        ea = addrs[i] - mem.CODE
+        op = code[ea]
+        after = code[addrs[i + 1] - mem.CODE] if i + 1 < len(addrs) else None
+        if op == 0xb4 and after in (0x40, 0x50):  # cjne A,#N; jc/jnc
+            return i, code[ea + 1]
+        if op == 0x54:  # anl A,#mask
+            return i, code[ea + 1] + 1
+        if op == 0x24 and after == 0x40:  # add A,#k; jc
+            return i, 0x100 - code[ea + 1]
+    return None
+
+def seed(m, code, ea, case):
+    """Puts `case` where the mov A,<src> at `ea` reads it from."""
+    op = code[ea - mem.CODE]
+    if op == 0xe5:
+        m.set_direct(code[ea - mem.CODE + 1], case)
+    else:
+        m.set_r(op & 7, case)
+
+def resolve(m, site):
+    """Targets of the jmp @A+DPTR at `site`, in case order, or None.
+
+    m: emulator.Machine over the image's code
+    """
+    code = m.code
+    addrs = setup(code, site)
+    found = guard(code, addrs)
+    if found is None:
+        return None
+    i, cases = found
+    if not 0 < cases <= max_cases:
+        return None
+    if not any(code[ea - mem.CODE] == 0x90 for ea in addrs[i:]):
+        return None  # no mov DPTR,#table, so no idea where the table is
+    # Start from where A was loaded if that's just before the guard, since
+    # the setup often reloads it from the same place.
+    seeded = i > 0 and code[addrs[i - 1] - mem.CODE] in _sources
+    start = addrs[i - 1] if seeded else addrs[i]
+    targets = []
+    try:
+        for case in range(cases):
+            m.reset(start)
+            if seeded:
+                seed(m, code, start, case)
+            else:
+                m.a = case
+            m.run(max_steps, stop=site)
+            if m.pc != site:
+                return None
+            m.step()
+            code.find(m.pc - mem.CODE)  # has to land in code
+            targets.append(m.pc)
+    except (emulator.Fault, IndexError):
+        return None
+    if cases > 1 and len(set(targets)) == 1:
+        return None  # A didn't matter, so it wasn't a table
+    return targets
+
+def scan(segments, only=None, layout=None):
+    """segments: [(start addr, bytes)] of CODE
+    only: subset of segments to look for jumps in, default all of them
+    layout: mem.BankLayout of the image, default mem.default_layout
+
+    returns: {jmp @A+DPTR address: [targets]} for every one resolved
+    """
+    sites = []
+    for start, data in segments if only is None else only:
+        data = bytes(data)
+        ea = data.find(b'\x73')
+        while ea >= 0:
+            sites.append(start + ea)
+            ea = data.find(b'\x73', ea + 1)
+    return resolve_all(segments, sites, layout)
+
+def resolve_all(segments, sites, layout=None):
+    """{site: [targets]} for every jmp @A+DPTR address in `sites` that
+    resolves, emulated over `segments` as in `scan`."""
+    m = emulator.Machine(Code(segments), layout=layout)
+    tables = {}
+    for site in sites:
+        targets = resolve(m, site)
+        if targets:
+            tables[site] = targets
+    return tables
+
+
+class JumpTables:
+    """Resolved tables for one view, handed to functions as analysis finds
+    them. Setting indirect branches reanalyzes the function, so each
+    function only gets each table once."""
+    def __init__(self, bv, tables):
+        self.bv = bv
+        self.tables = tables
+        self.sites = sorted(tables)
+        self.applied = {}  # :: {function start: {jmp addresses}}
+        self.lock = threading.Lock()  # notifications come from workers
+
+    def sites_in(self, func):
+        """Sites inside one of func's basic blocks. Its address range can
+        be stale, or span other functions' code."""
+        found = []
+        for block in func.basic_blocks:
+            lo = bisect.bisect_left(self.sites, block.start)
+            hi = bisect.bisect_left(self.sites, block.end)
+            found += self.sites[lo:hi]
+        return found
+
+    def apply(self, func):
+        sites = self.sites_in(func)
+        with self.lock:
+            done = self.applied.setdefault(func.start, set())
+            todo = [ea for ea in sites if ea not in done]
+            done.update(todo)
+        for ea in todo:
+            set_indirect_branches(func, ea, sorted(set(self.tables[ea])))
+
+def set_indirect_branches(func, source, targets):
+    branches = [(func.arch, target) for target in targets]
+    params = inspect.signature(func.set_auto_indirect_branches).parameters
+    if next(iter(params)) == 'source_arch':  # older API
+        func.set_auto_indirect_branches(func.arch, source, branches)
+    else:
+        func.set_auto_indirect_branches(source, branches, func.arch)
+
+class AnalysisNotification(BinaryDataNotification):
+    def __init__(self, tables): self.tables = tables
+    def function_added(self, bv, func): self.tables.apply(func)
+    def function_updated(self, bv, func): self.tables.apply(func)
+
+def register_hook(bv, tables):
+    """tables: from `scan`, kept in the view's session_data"""
+    bv.session_data['jump_tables'] = jt = JumpTables(bv, tables)
+    bv.register_notification(AnalysisNotification(jt))
+    return jt
@@ -11,41 +11,187 @@ To do this it passes state from a BinaryDataNotification registered with a
 particular BinaryView, straight into the get_low_level_il(..) of an
 Architecture.
 
-This... Is supported for Function and BinaryView objects via .session_data, but
+This is supported for Function and BinaryView objects via .session_data, but
 not for LowLevelILFunction since il.source_function isn't initialized at the
-time of IL lift, just il.handle is.
+time of IL lift, just il.handle is. The core does know which function owns the
+IL (BNGetLowLevelILOwnerFunction) though - that's a slow round trip, so it's done once per
+lift and remembered in the lowlevelil.Lift (per thread, since analysis is
+threaded) until the next lift starts. After that, each instruction is one
+dict lookup by address. Functions grow while they're lifted, so nothing
+about the function's extent is trusted to skip the lookup.
 
-Long story short, bad things happened and this code will break horribly if you
-open more than one tab or window. If I understood how Architecture worked,
-maybe the damage would be limited to the 8051 arch, but w/e right now.
+Each BinaryView keeps its own PatchRegistry, so several images can be open in
+one process without stepping on each other.
+
+Finding patches takes rounds of reanalysis, so the assignments are saved in
+the view's metadata as {patch key: [addrs]}, once page trampolines converge
+and on the next analysis completion after any later assignment. A reopened
+database gets them all back in `PatchRegistry.restore` before anything is
+lifted. Every patch has a `key` for this: set explicitly for helpers (their
+docstrings are what functions get renamed to, and free to change), 'page N'
+for page trampolines.
 """
-import inspect, ctypes
+import inspect, threading
 from binaryninja import BinaryDataNotification
-from .. import mem
+from binaryninja import _binaryninjacore as core
+from binaryninja.function import Function
+from binaryninja.log import log_info, log_warn
+from .. import mem, lowlevelil
+
+metadata_key = 'i8051.llil_patches'
+metadata_version = 1
+
+class PatchRegistry:
+    """LLIL patches for one BinaryView, by instruction address.
+
+    Also batches up the reanalysis patching causes: popular helpers have
+    thousands of callers, and reanalyzing each of them immediately (which
+    fires function_updated, which comes back here...) is a storm.
+    """
+    def __init__(self, bv):
+        self.bv = bv
+        self.patches = {}  # live: lifts read it without the lock
+        self.lock = threading.Lock()  # notifications come from workers
+        self.pending = {}  # start: function, to reanalyze at next flush
+        self.requested = 0  # times a caller asked for a reanalysis
+        self.reanalyzed = 0  # times one actually happened
+        self.then = []  # run once the next flush has kicked off analysis
+        self.trampolines = {}  # addr: flash page it switches to
+        self.paged_calls = set()  # call sites fixup_page_trampolines has seen
+        self.trampoline_rounds = 0  # in the current fixed-point run
+        self.unsaved = False  # assigned since the last save
+
+    def __len__(self): return len(self.patches)
+
+    def get(self, addr): return self.patches.get(addr)
+
+    def assign(self, addr, patch):
+        """Returns whether anything changed. Changes get saved on the next
+        analysis completion, if nothing saved them before that."""
+        if self.patches.get(addr) is patch:
+            return False
+        self.patches[addr] = patch
+        with self.lock:
+            first, self.unsaved = not self.unsaved, True
+        if first:  # else a save is already scheduled
+            self.bv.add_analysis_completion_event(self.save)
+        return True
 
-state = {}
+    def save(self):
+        """Stores every assignment in the view's metadata, if any changed."""
+        with self.lock:
+            if not self.unsaved:
+                return
+            self.unsaved = False
+            assigned = list(self.patches.items())
+        by_key = {}
+        for addr, patch in assigned:
+            by_key.setdefault(patch.key, []).append(addr)
+        self.bv.store_metadata(metadata_key, {
+            'version': metadata_version, 'patches': by_key})
+        log_info('LLIL patches: saved %d assignments' % len(assigned))
 
-def arch_data(arch):
-    """Ghetto replacement for a session_state between BV and Arch."""
-    global state
-    unique_id = ctypes.addressof(arch.handle.contents)
-    if unique_id not in state:
-        state[unique_id] = {}
-    return state[unique_id]
+    def restore(self):
+        """Loads what `save` stored, in one go. Call before analysis starts,
+        so nothing needs reanalyzing for it. Returns how many were loaded.
+        """
+        try:
+            saved = self.bv.query_metadata(metadata_key)
+        except KeyError:
+            return 0
+        if saved.get('version') != metadata_version:
+            return 0
+        with self.lock:
+            for key, addrs in saved['patches'].items():
+                patch = patch_for(key)
+                if patch is None:
+                    log_warn('LLIL patches: no patch %r any more, dropping '
+                             '%d assignments' % (key, len(addrs)))
+                    continue
+                self.patches.update(dict.fromkeys(addrs, patch))
+                if key.startswith('page '):
+                    self.paged_calls.update(addrs)
+        log_info('LLIL patches: restored %d assignments' % len(self.patches))
+        return len(self.patches)
+
+    def reanalyze_later(self, func, changed=True):
+        """Queue a function for the next batched reanalysis, unless its
+        patches didn't actually change.
+
+        Only bookkeeping happens under the lock: calling into the host while
+        holding it can deadlock with a flush running on another thread.
+        """
+        with self.lock:
+            self.requested += 1
+            if not changed:
+                return
+            first = not self.pending
+            self.pending[func.start] = func
+        if first:  # else a flush is already scheduled
+            self.bv.add_analysis_completion_event(self.flush)
+            self.bv.update_analysis()  # make sure there's a completion
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            then, self.then = self.then, []
+            self.reanalyzed += len(pending)
+        for func in pending.values():
+            func.reanalyze()
+        if pending:
+            log_info('LLIL patches: reanalyzing %d functions, %d avoided so far'
+                     % (len(pending), self.requested - self.reanalyzed))
+        for callback in then:
+            self.bv.add_analysis_completion_event(callback)
+        if then:
+            self.bv.update_analysis()
+
+    def after_flush(self, callback):
+        """Run callback on the analysis completion after the next flush."""
+        with self.lock:
+            if self.pending:
+                self.then.append(callback)
+                return
+        # nothing pending, so no flush coming either
+        self.bv.add_analysis_completion_event(callback)
+        self.bv.update_analysis()
+
+def registry(bv):
+    """The view's PatchRegistry, created on first use."""
+    data = bv.session_data
+    if 'llil_patches' not in data:
+        data['llil_patches'] = PatchRegistry(bv)
+    return data['llil_patches']
 
 def register_hook(bv):
     """
-    Initializes some global state in a place it shouldn't, and registers an
-    analysis hook to fill that state with aptches.
+    Registers analysis hooks to fill the view's PatchRegistry with patches.
     """
+    registry(bv)
     bv.register_notification(AnalysisNotification(bv))
     bv.add_analysis_completion_event(lambda:fixup_page_trampolines(bv))
 
-def patch_at(arch, addr):
-    """Checks global state for stashed LLIL patches."""
-    #if addr in self.__class__.session_data:
-    #    log_info('## patched in %s at 0x%x' % (repr(build), addr))
-    return arch_data(arch).get(addr)
+def patch_at(lift, il, addr):
+    """Checks the lifted function's view for stashed LLIL patches.
+
+    lift: lowlevelil.Lift for `il`, which remembers the lookup until the
+    next function starts lifting.
+    """
+    if lift.patches is None:
+        lift.patches = lift_patches(il)
+    return lift.patches.get(addr)
+
+def lift_patches(il):
+    """{addr: patch} of the view owning the function being lifted, the
+    registry's own dict so patches assigned mid-lift still show up."""
+    func = il.source_function
+    if func is None:
+        owner = core.BNGetLowLevelILOwnerFunction(il.handle)
+        if not owner:
+            return {}
+        func = Function(handle=owner)
+    patches = func.view.session_data.get('llil_patches')
+    return patches.patches if patches is not None else {}
 
 class AnalysisNotification(BinaryDataNotification):
     def __init__(self, view): pass
@@ -61,12 +207,23 @@ class AnalysisNotification(BinaryDataNotification):
 def inline_xref_calls(bv, func):
     if func.name in patches:
         patch = patches[func.name]
+        mailbox = registry(bv)
         for ref in bv.get_code_refs(func.start):
             # TODO ensure it's actually a call being stomped on
-            arch_data(func.arch)[ref.address] = patch
-            ref.function.reanalyze()  # probably needed to set up xrefs
+            changed = mailbox.assign(ref.address, patch)
+            # probably needed to set up xrefs
+            mailbox.reanalyze_later(ref.function, changed)
+
+def keyed(key):
+    """Sets a helper patch's `key`, which saved assignments refer to. Never
+    change one that's been released."""
+    def tag(patch):
+        patch.key = key
+        return patch
+    return tag
 
 def patches():
+    @keyed('xstore_ptr')
     def xstore_ptr_call(il,vs,ea):
         'x[DPTR] := PTR'
         #'\xeb\xf0\xa3\xea\xf0\xa3\xe9\xf0"'
@@ -80,6 +237,7 @@ def patches():
         il.append(il.set_reg(2, 'DPTR', il.add(2, il.const(1, 1), il.reg(2, 'DPTR'))))
         return 3  # patch call
 
+    @keyed('xload_ptr')
     def xload_ptr_call(il,vs,ea):
         'PTR := x[DPTR]'
         # '\xe0\xfb\xa3\xe0\xfa\xa3\xe0\xf9"'
@@ -93,6 +251,7 @@ def patches():
         il.append(il.set_reg(2, 'DPTR', il.add(2, il.const(1, 1), il.reg(2, 'DPTR'))))
         return 3
 
+    @keyed('read_code_word')
     def read_code_word(il,vs,ea):
         'x[R0:B++] := c[DPTR++]'
         il.append(il.call(il.const_pointer(6, vs[0])))
@@ -105,35 +264,91 @@ def patches():
 
     return locals()
 patches = patches()
-patches = {patches[name].__doc__:patches[name] for name in patches}
 # oh my god did I just write Javascript to avoid OOP, ugggghhggh
+by_key = {patch.key: patch for patch in patches.values()}
+patches = {patch.__doc__: patch for patch in by_key.values()}
 
-def fixup_page_trampolines(bv):
-    def jump_page(page):
-        def page_trampoline(il,vs,ea):
-            target = il.add(6, il.const(6, mem.CODE + 0x8000 * page), il.reg(2, 'DPTR'))
-            il.append(il.call(target))  
-            # TODO figure out if there's a way to force jump to create functions
-            #il.set_indirect_branches([target])  # <- this ain't it
-            return 3  # patch ljmp
-        return page_trampoline
-
-    # TODO find these by searching for P1.{0,1} writes iff works well
-    # TODO or at least move pointers to Surface bv and have it push 'em
-    # '\xc0\x08t5\xc0\xe0\xc0\x82\xc0\x83u\x08\n\xc2\x90\xc2\x91"'  # page 0
-    trampolines = {0:0x3500, 1:0x3512, 2:0x3524, 3:0x3536}   # note exact stride
+_pages = {}  # page: patch, so reassigning one is recognized as no change
+
+def jump_page(page):
+    if page not in _pages:
+        _pages.setdefault(page, _jump_page(page))
+    return _pages[page]
+
+def _jump_page(page):
+    def page_trampoline(il,vs,ea):
+        layout = lowlevelil.lifting.arch.bank_layout  # the view's
+        bank = layout.bank_start(page) - layout.common
+        target = il.add(6, il.const(6, bank), il.reg(2, 'DPTR'))
+        il.append(il.call(target))  
+        # TODO figure out if there's a way to force jump to create functions
+        #il.set_indirect_branches([target])  # <- this ain't it
+        return 3  # patch ljmp
+    page_trampoline.key = 'page %d' % page
+    return page_trampoline
+
+def patch_for(key):
+    """Inverse of patch.key, None if there's no such patch."""
+    if key.startswith('page '):
+        return jump_page(int(key[5:]))
+    return by_key.get(key)
+
+# Paged calls found by one round only show up as xrefs after reanalysis,
+# which can expose more paged calls. Give up eventually if it's diverging.
+max_trampoline_rounds = 16
+
+def patch_page_trampolines(bv):
+    """Patches call sites of page trampolines not seen before.
+
+    Returns how many new ones were found.
+    """
+    mailbox = registry(bv)
     added = 0
-    for page in trampolines:
-        for ref in bv.get_code_refs(trampolines[page]):
-            mailbox = arch_data(bv.arch)
-            if ref.address not in mailbox:
-                mailbox[ref.address] = jump_page(page)
-                ref.function.reanalyze()
-                added += 1
-    print ('Trampoline LLIL patch found %d new paged calls.' % (added,))
-    if added:  # recurse until no new branches discovered?
-        # TODO don't think it's triggering recursively, bummer
-        # for now:
-        # > from i8051.experiments import llil_mangler
-        # > llil_mangler.fixup_page_trampolines(bv)
-        bv.add_analysis_completion_event(lambda:fixup_page_trampolines(bv))
+    # pushed by the view, see Family8051View.find_bank_trampolines
+    for trampoline, page in mailbox.trampolines.items():
+        for ref in bv.get_code_refs(trampoline):
+            if ref.address in mailbox.paged_calls:
+                continue
+            mailbox.paged_calls.add(ref.address)
+            changed = mailbox.assign(ref.address, jump_page(page))
+            mailbox.reanalyze_later(ref.function, changed)
+            added += 1
+    mailbox.trampoline_rounds += 1
+    log_info('Page trampolines, round %d: %d new paged calls, %d total' %
+             (mailbox.trampoline_rounds, added, len(mailbox.paged_calls)))
+    return added
+
+def fixup_page_trampolines(bv):
+    """Analysis completion hook, re-queues rounds until a fixed point.
+
+    Each round waits for the reanalysis it caused to finish before looking
+    for xrefs again, see PatchRegistry.flush.
+    """
+    registry(bv).trampoline_rounds = 0
+    _fixup_round(bv)
+
+def _fixup_round(bv):
+    mailbox = registry(bv)
+    if not patch_page_trampolines(bv):
+        log_info('Page trampolines converged after %d rounds' %
+                 mailbox.trampoline_rounds)
+        mailbox.save()
+    elif mailbox.trampoline_rounds >= max_trampoline_rounds:
+        log_warn('Page trampolines still finding calls after %d rounds, '
+                 'giving up' % mailbox.trampoline_rounds)
+        mailbox.save()
+    else:
+        mailbox.after_flush(lambda:_fixup_round(bv))
+
+def converge_page_trampolines(bv, max_rounds=max_trampoline_rounds):
+    """Blocking version, for scripts and the REPL."""
+    mailbox = registry(bv)
+    mailbox.trampoline_rounds = 0
+    for _ in range(max_rounds):
+        if not patch_page_trampolines(bv):
+            mailbox.save()
+            return True
+        mailbox.flush()
+        bv.update_analysis_and_wait()
+    mailbox.save()
+    return False
@@ -0,0 +1,88 @@
+"""Lazy view registration, so sessions that never open 8051 firmware don't
+pay for importing every device view at startup.
+
+Each view is registered as a ViewStub that only knows its names and the
+magic checks from its profile JSON. The device module is imported the first
+time a stub's checks pass on a file (the real view still gets the final
+say), or when the view is opened by name, say picked by hand for a raw dump.
+Calling conventions wait for the first view or lift that needs the 8051
+platform, see `calling_conventions.register`.
+
+Set I8051_EAGER=1 in the environment to import and register everything up
+front instead, as before.
+"""
+import importlib, threading
+from binaryninja.binaryview import BinaryView
+from binaryninja.log import log_warn
+from . import probe
+from .devices import classes, magic
+
+_lock = threading.Lock()
+
+class ViewStub(BinaryView):
+    """Stands in for `loader()`'s view class until it's needed.
+
+    checks: [(offset, length, predicate)] that must all pass before loading,
+    or None for views that are only ever picked by hand
+    """
+    loader = None
+    checks = None
+    real = None
+
+    @classmethod
+    def load(cls):
+        with _lock:
+            if cls.real is None:
+                cls.real = cls.loader()
+                if cls.real.name != cls.name:
+                    log_warn('View stub %r loaded %r' % (cls.name,
+                                                          cls.real.name))
+        return cls.real
+
+    @classmethod
+    def is_valid_for_data(cls, data):
+        if cls.checks is None:
+            return False
+        header = probe.header(data)
+        if not all(test(header.read(offset, length))
+                   for offset, length, test in cls.checks):
+            return False
+        return cls.load().is_valid_for_data(data)
+
+    def __new__(cls, data):
+        # The host instantiates registered classes by calling them. Handing
+        # back an instance of the real view skips ViewStub.__init__.
+        return cls.load()(data)
+
+def stub(name, long_name, loader, checks=None):
+    """ViewStub subclass to register under the real view's names."""
+    probe.regions.extend((offset, length)
+                         for offset, length, _ in checks or ())
+    return type(ViewStub)(name + '_stub', (ViewStub,), {
+        'name': name, 'long_name': long_name,
+        'loader': staticmethod(loader), 'checks': checks})
+
+def _attr(module, name):
+    return lambda: getattr(importlib.import_module(module, __package__), name)
+
+def _generic(stem):
+    return lambda: importlib.import_module(
+        '.devices.profile', __package__).generic_view(stem)
+
+def views():
+    """A stub for every view the eager path registers."""
+    stubs = [
+        # names have to match the classes, ViewStub.load warns if they don't
+        stub('8051', 'Intel 8051 Family',
+             _attr('.binaryview', 'Family8051View')),
+        stub('8051 HEX', '8051 Intel HEX/SREC image',
+             _attr('.devices.intel_hex', 'IntelHexView'),
+             [(0, 1, lambda b: b in (b':', b'S'))]),
+    ]
+    for stem in magic.stems():
+        spec = magic.spec(stem)
+        loader = (_attr('.devices.' + stem, classes[stem]) if stem in classes
+                  else _generic(stem))
+        stubs.append(stub(spec['name'], spec.get('long_name', spec['name']),
+                          loader, [magic.check(m) for m in spec['magic']]))
+    return stubs
@@ -1,3 +1,4 @@
+import ctypes, threading
 from binaryninja.log import log_info, log_warn
 from binaryninja.lowlevelil import LLIL_TEMP, LowLevelILFunction
 from binaryninja.enums import LowLevelILOperation
@@ -20,7 +21,61 @@ def unlifted_todo(opcodes, ops):
 def unimpl(il,vs,ea): il.append(il.unimplemented())
 
 
+class Lift(threading.local):
+    """State for the function currently being lifted, one per thread.
+
+    The core lifts a function by calling get_instruction_low_level_il(..)
+    once per instruction with the same LowLevelILFunction, and lifts on
+    several worker threads at once. Anything worth computing once per
+    function (the architecture object, branch labels, LLIL patches) goes
+    here instead of being looked up per instruction.
+    """
+    def __init__(self):
+        self.reset(None, None)
+
+    def reset(self, key, arch):
+        self.key, self.arch = key, arch
+        self.labels = {}     # :: {addr: LowLevelILLabel | None}
+        self.patches = None  # filled in by llil_mangler.patch_at
+        self.next = None     # fallthrough of the last instruction lifted
+
+    def label(self, il, addr):
+        """Label for an instruction address in this function, or None."""
+        try:
+            return self.labels[addr]
+        except KeyError:
+            t = self.labels[addr] = il.get_label_for_address(self.arch, addr)
+            return t
+
+lifting = Lift()
+
+def lift_context(il, arch, addr):
+    """-> `lifting`, starting over if `il` is a new lift.
+
+    The host has no per-lift callback, and wraps the IL in a new object for
+    every instruction, so this compares the IL's handle. A new lift starts
+    with empty IL, which also catches a handle the core recycled from a freed
+    function, but asking costs a round trip into the core. That's skipped for
+    an instruction at the previous one's fallthrough (`Tables.falls_through`)
+    with the same handle, which can only be the same lift going on.
+    """
+    key = ctypes.addressof(il.handle.contents)
+    if addr == lifting.next and key == lifting.key:
+        return lifting
+    if key != lifting.key or not len(il):
+        lifting.reset(key, arch)
+    return lifting
+
+
 def low_level_il(size, name, ops):
+    """Emitter for one opcode, :: (il, vals, ea) -> None | size override
+
+    Operand kinds are resolved here, once per opcode while Tables is built,
+    so emitters never inspect operand strings while lifting.
+    """
+    rd = [reader(op) for op in ops]  # :: (il, val) -> expr
+    wr = [writer(op) for op in ops]  # :: (il, expr, val) -> None
+
     if name.endswith('jmp') and ops[0] == 'code addr':
         return lambda il,vs,ea: il.append(il.jump(il.const_pointer(6, vs[0])))
     if name == 'jmp' and ops[0] == '@A+DPTR':
@@ -66,9 +121,9 @@ def low_level_il(size, name, ops):
                 elif ops[0] == 'data addr' and vs[0] == mem.SFRs + 0x83:
                     il.append(il.nop())
                 else:
-                    il.append(il.push(1, r(ops[0], il, vs[0])))
+                    il.append(il.push(1, rd[0](il, vs[0])))
             else:
-                il.append(il.push(1, r(ops[0], il, vs[0])))
+                il.append(il.push(1, rd[0](il, vs[0])))
         def pop(il,vs,ea):
             if 0:
                 if ops[0] == 'data addr' and vs[0] == mem.SFRs + 0x82:
@@ -78,47 +133,48 @@ def low_level_il(size, name, ops):
                     il.append(il.set_reg(2, 'DPTR', il.pop(2)))
                     return 4
                 else:
-                    w(ops[0], il, il.pop(1), vs[0])
+                    wr[0](il, il.pop(1), vs[0])
             else:
-                w(ops[0], il, il.pop(1), vs[0])
+                wr[0](il, il.pop(1), vs[0])
 
         def jz(il,vs,ea):
-            branch(il, il.compare_equal(1, il.reg(1, 'A'), il.const(1, 0)), il.const_pointer(6, vs[0]))
+            branch(il, il.compare_equal(1, il.reg(1, 'A'), il.const(1, 0)), vs[0])
         def jnz(il,vs,ea):
-            branch(il, il.compare_not_equal(1, il.reg(1, 'A'), il.const(1, 0)), il.const_pointer(6, vs[0]))
+            branch(il, il.compare_not_equal(1, il.reg(1, 'A'), il.const(1, 0)), vs[0])
         def jc(il,vs,ea):
-            branch(il, il.flag('c'), il.const_pointer(6, vs[0]))
+            branch(il, il.flag('c'), vs[0])
         def jnc(il,vs,ea):
-            branch(il, il.not_expr(0, il.flag('c')), il.const_pointer(6, vs[0]))
+            branch(il, il.not_expr(0, il.flag('c')), vs[0])
         def jb(il,vs,ea):  # a465 
             #log_warn('jb @ '+hex(ea))
-            branch(il, r(ops[0], il, vs[0]), il.const_pointer(6, vs[1]))
+            branch(il, rd[0](il, vs[0]), vs[1])
         def jnb(il,vs,ea):  # c5ac
-            branch(il, il.not_expr(0, r(ops[0], il, vs[0])), il.const_pointer(6, vs[1]))
+            branch(il, il.not_expr(0, rd[0](il, vs[0])), vs[1])
         def cjne(il,vs,ea): # currently not handling @R0 @R1 TODO or am I?
             # a5c2    ehh won't work at all this way, needs new wrapper that doesn't set result
-            dst, src = r(ops[0], il), r(ops[1], il, vs[0])
+            dst, src = rd[0](il, 0), rd[1](il, vs[0])
             il.append(il.set_flag('c', il.compare_unsigned_less_than(1, dst, src)))
-            ret = branch(il, il.compare_not_equal(1, dst, src), il.const_pointer(2, vs[1]))
+            ret = branch(il, il.compare_not_equal(1, dst, src), vs[1], 2)
             if ret: return ret
+        if size == 2: # djnz Rn, rel
+            counter = lambda il,vs: rd[0](il, 0)
+            target = 0
+        else: # djnz direct, rel
+            counter = lambda il,vs: rd[0](il, vs[0])
+            target = 1
         def djnz(il,vs,ea):
-            if size == 2:
-                src = r(ops[0], il)
-                dst = il.const_pointer(2, vs[0])
-            else:
-                src = r(ops[0], il, vs[0])
-                dst = il.const_pointer(2, vs[1])
+            src = counter(il, vs)
             decr = il.sub(1, src, il.const(1, 1))
-            w(ops[0], il, decr)
-            branch(il, il.compare_not_equal(1, decr, il.const(1, 0)), dst)
+            wr[0](il, decr, 0)
+            branch(il, il.compare_not_equal(1, decr, il.const(1, 0)), vs[target], 2)
 
         def xch(il,vs,ea):  # a732 a8c3
             v = 0 if not len(vs) else vs[0]
-            il.append(il.set_reg(1, LLIL_TEMP(0), r(ops[0], il)))
-            w(ops[0], il, r(ops[1], il, v))
-            w(ops[1], il, il.reg(1, LLIL_TEMP(0)), v)
+            il.append(il.set_reg(1, LLIL_TEMP(0), rd[0](il, 0)))
+            wr[0](il, rd[1](il, v), 0)
+            wr[1](il, il.reg(1, LLIL_TEMP(0)), v)
         def swap(il,vs,ea):
-            w('A', il, il.rotate_left(1, r('A', il), il.const(1, 4)))
+            write_A(il, il.rotate_left(1, read_A(il, 0), il.const(1, 4)), 0)
 
         def mul(il,vs,ea): # mul AB   a732, a751
             product = il.mult(2, il.reg(1, 'A'), il.reg(1, 'B'), flags='*')
@@ -170,71 +226,74 @@ def low_level_il(size, name, ops):
         handler = lambda il,a,b,fl:il.sub_borrow(1, a, b, il.flag('c'), flags=fl) 
         #flags = '*'  # TODO should be *, but tired of warning lag
     if handler:
-        ret = dispatch_2operand(ops, handler, flags)
+        ret = dispatch_2operand(ops, rd, handler, flags)
         if ret: return ret
         
             
     if name in ['inc', 'dec']:
         if ops[0] == 'DPTR':
             def inc_dptr(il,vs,ea):
-                w('DPTR', il, il.add(2, r('DPTR', il), il.const(2, 1)))
+                write_DPTR(il, il.add(2, read_DPTR(il, 0), il.const(2, 1)), 0)
             return inc_dptr
         else: # Rx, A, or @Rn
             delta = 1 if name == 'inc' else -1
             def inc_dec(il,vs,ea):
-                w(ops[0], il, il.add(1, r(ops[0], il), il.const(1, delta)))
+                wr[0](il, il.add(1, rd[0](il, 0), il.const(1, delta)), 0)
             return inc_dec 
     if name == 'mov':
         if ops == ['DPTR', '#data']:
             def load_DPTR_imm(il,vs,ea):
-                w('DPTR', il, il.const(2, vs[0]))
+                write_DPTR(il, il.const(2, vs[0]), 0)
             return load_DPTR_imm
         if size == 1:
             def mov(il,vs,ea):
-                val = r(ops[1], il)
-                w(ops[0], il, val)
+                val = rd[1](il, 0)
+                wr[0](il, val, 0)
             return mov
         if size == 2:
             def mov_8bit(il,vs,ea):
                 # variable operand always on the read, with one exception
-                val = r(ops[1], il, vs[0]) # usages should sort themselves out
-                w(ops[0], il, val, vs[0])  # fingers crossed
+                val = rd[1](il, vs[0]) # usages should sort themselves out
+                wr[0](il, val, vs[0])  # fingers crossed
             return mov_8bit
         if size == 3:
             def mov_8bit_2x(il,vs,ea):
                 # operands always dst,src ordered, but encoding is src,dst
                 # core.ana takes care of ordering into operand-order
-                val = r(ops[1], il, vs[1]) 
-                w(ops[0], il, val, vs[0]) 
+                val = rd[1](il, vs[1]) 
+                wr[0](il, val, vs[0]) 
             return mov_8bit_2x
     if name in ['clr', 'setb', 'cpl']:
         is_reg = not ops[0].endswith('bit addr')
         sz = 1 if ops == ['A'] else 0
         def _tmp():
             def clr(il,vs,ea):
-                w(ops[0], il, il.const(sz, 0), 0 if is_reg else vs[0])
+                wr[0](il, il.const(sz, 0), 0 if is_reg else vs[0])
             def setb(il,vs,ea):
-                w(ops[0], il, il.const(sz,1), 0 if is_reg else vs[0])
+                wr[0](il, il.const(sz,1), 0 if is_reg else vs[0])
             def cpl(il,vs,ea):
                 v = 0 if is_reg else vs[0]
-                val = il.neg_expr(sz, r(ops[0], il, v)) 
-                w(ops[0], il, val, v)
+                val = il.neg_expr(sz, rd[0](il, v)) 
+                wr[0](il, val, v)
             return locals()
         return _tmp()[name]
     if name in ['rlc', 'rl', 'rrc', 'rr']:  # rlc A
-        def rot_A(il,vs,ea): # a88c
-            fun = {
-                'rlc':il.rotate_left_carry,
-                'rl':il.rotate_left,
-                'rrc':il.rotate_right_carry,
-                'rr':il.rotate_right,
-            }[name]
-            if name.endswith('c'):
-                w('A', il, fun(1, il.reg(1, 'A'), il.const(1, 1), 
-                               il.flag('c'), flags='zsp')) # TODO add c flag, for some reason 'zspc' doesn't generate
+        method = {
+            'rlc':'rotate_left_carry',
+            'rl':'rotate_left',
+            'rrc':'rotate_right_carry',
+            'rr':'rotate_right',
+        }[name]
+        if name.endswith('c'):
+            def rot_A(il,vs,ea): # a88c
+                fun = getattr(il, method)
+                write_A(il, fun(1, il.reg(1, 'A'), il.const(1, 1), 
+                                il.flag('c'), flags='zsp'), 0) # TODO add c flag, for some reason 'zspc' doesn't generate
                 # a516 good example of this
-            else:
-                w('A', il, fun(1, il.reg(1, 'A'), il.const(1, 1), flags='zsp'))
+        else:
+            def rot_A(il,vs,ea):
+                fun = getattr(il, method)
+                write_A(il, fun(1, il.reg(1, 'A'), il.const(1, 1), flags='zsp'), 0)
         return rot_A
 
 
@@ -243,11 +302,12 @@ def low_level_il(size, name, ops):
 
 
     if name == 'movc': # either A, @A+PC or A, @A+DPTR
+        from_dptr = ops[1].endswith('DPTR')
         def movc(il,vs,ea): 
-            base = il.reg(2, 'DPTR') if ops[1].endswith('DPTR') else il.const_pointer(2, ea)
+            base = il.reg(2, 'DPTR') if from_dptr else il.const_pointer(2, ea)
             saddr = il.add(2,  il.reg(1, 'A'), base)
             eaddr = il.add(2, il.const(2, mem.CODE), saddr)
-            w('A', il, il.load(1, eaddr))
+            write_A(il, il.load(1, eaddr), 0)
         return movc
     if name == 'movx':
         if ops[0] == 'A': # load
@@ -285,28 +345,33 @@ def low_level_il(size, name, ops):
     return unimpl
         
 
-def r(kind, il, v=0):
-    """
+def reader(kind):
+    """Operand read for `kind`, :: (il, v) -> expr
+
     Never called with MOVX, handles IRAM/SFRs addresses only. The MOVX
     instruction is distinct from the others.
     
     Never called on 16-bit immediates. No way to distinguish from 8-bit.
     """
     if kind.startswith('@'):
-        reg = il.reg(1, kind[1:])
-        addr = il.add(6, reg, il.const(6, mem.IRAM))
-        return il.load(1, addr)
+        reg = kind[1:]
+        def read_indirect(il, v):
+            addr = il.add(6, il.reg(1, reg), il.const(6, mem.IRAM))
+            return il.load(1, addr)
+        return read_indirect
     if kind == '#data':
-        return il.const(1, v)
-    if kind.endswith('addr'):
-        if kind == 'code addr':
-            return il.const_pointer(6, v)
-        if kind == 'data addr':
+        return lambda il, v: il.const(1, v)
+    if kind == 'code addr':
+        return lambda il, v: il.const_pointer(6, v)
+    if kind == 'data addr':
+        def read_direct(il, v):
             if v in mem.regs:
                 return il.reg(1, mem.regs[v])
             # TODO: overlay PSW as register? how to compute from flags?
             return il.load(1, il.const_pointer(6, v))
-        if kind.endswith('bit addr'): # cosmetic / prefix, optional
+        return read_direct
+    if kind.endswith('bit addr'): # cosmetic / prefix, optional
+        def read_bit(il, v):
             byte,bit = v
             if byte == mem.PSW and bit in mem.flags:
                 return il.flag(mem.flags[bit])
@@ -318,37 +383,43 @@ def r(kind, il, v=0):
                 return il.test_bit(1, il.reg(1, mem.regs[byte]), il.const(0, 1 << bit))
             addr = il.const_pointer(6, byte)
             return il.test_bit(1, il.load(1, addr), il.const(0, 1 << bit))
+        return read_bit
     if kind == 'DPTR':
-        return il.reg(2, kind)
-    if kind.startswith('R') or kind in ['A', 'B'] or kind in mem.regs:
-        return il.reg(1, kind)
+        return lambda il, v: il.reg(2, kind)
+    if kind.startswith('R') or kind in ['A', 'B']:
+        return lambda il, v: il.reg(1, kind)
     if kind == 'C':
-        return il.flag('c')
+        return lambda il, v: il.flag('c')
 
-    # @A+DPTR and @A+PC can be special-cased in their instructions
+    # @A+DPTR and @A+PC can be special-cased in their instructions, the
+    # rest had better not get read
+    def unreachable(il, v):
+        log_warn('r '+repr((kind,il,v)))
+        assert not "reachable"
+    return unreachable
 
-    log_warn('r '+repr((kind,il,v)))
-    assert not "reachable"
 
+def writer(kind):
+    """Operand write for `kind`, :: (il, val, v) -> None
 
-def w(kind, il, val, v=0):
-    """
-    kind: type of write
-    il: LowLevelILFunction
     val: symbolic source
-    v: constant source
+    v: constant operand, address for direct and bit writes
     """
     if kind.startswith('@'):
-        reg = il.reg(1, kind[1:])
-        addr = il.add(6, reg, il.const(6, mem.IRAM))
-        return il.append(il.store(1, addr, val))
-    if kind.endswith('addr'):
-        if kind == 'data addr':
+        reg = kind[1:]
+        def write_indirect(il, val, v):
+            addr = il.add(6, il.reg(1, reg), il.const(6, mem.IRAM))
+            return il.append(il.store(1, addr, val))
+        return write_indirect
+    if kind == 'data addr':
+        def write_direct(il, val, v):
             if v in mem.regs:
                 return il.append(il.set_reg(1, mem.regs[v], val)) # aa5b good test aa68
             # TODO: overlay PSW as register? how to compute from flags?
             return il.append(il.store(1, il.const_pointer(6, v), val))
-        if kind.endswith('bit addr'): # cosmetic / prefix, optional
+        return write_direct
+    if kind.endswith('bit addr'): # cosmetic / prefix, optional
+        def write_bit(il, val, v):
             byte,bit = v
             if byte == mem.PSW and bit in mem.flags:
                 return il.append(il.set_flag(mem.flags[bit], val))
@@ -362,26 +433,31 @@ def w(kind, il, val, v=0):
             mask = il.shift_left(1, il.const(1, 1), il.const(1, bit))
             val = il.or_expr(1, il.load(1, addr), mask)  # <- also only sets, never clears :|
             return il.append(il.store(1, addr, val))
+        return write_bit
     if kind.startswith('R') or kind in ['A', 'B']:
-        return il.append(il.set_reg(1, kind, val))
+        return lambda il, val, v: il.append(il.set_reg(1, kind, val))
     if kind == 'DPTR':
-        return il.append(il.set_reg(2, kind, val))
+        return lambda il, val, v: il.append(il.set_reg(2, kind, val))
     if kind == 'C':
-        return il.append(il.set_flag('c', val))
+        return lambda il, val, v: il.append(il.set_flag('c', val))
 
-    log_warn('w '+repr((kind,il,val,v)))
-    assert not "reachable"
+    def unreachable(il, val, v):
+        log_warn('w '+repr((kind,il,val,v)))
+        assert not "reachable"
+    return unreachable
 
+read_A, write_A = reader('A'), writer('A')
+read_DPTR, write_DPTR = reader('DPTR'), writer('DPTR')
 
-def branch(il, pred, dst):
-    """Copying from example w/o understanding"""
-    t = None
-    if il[dst].operation == LowLevelILOperation.LLIL_CONST:
-        # Hmm. Should I be doing this for all SFRs?
-        
-        t = il.get_label_for_address(Architecture['8051'], il[dst].value)
-        # And arch is cached, right?
-    
+
+def branch(il, pred, target, size=6):
+    """Conditional branch to a static target.
+
+    Branches inside the function go straight to the target's label, which
+    the current Lift remembers so branch-heavy code only asks once per
+    target. Anything else gets a jump the core can resolve later.
+    """
+    t = lifting.label(il, target)
     indirect = t is None
     if indirect:
         t = LowLevelILLabel()
@@ -390,12 +466,12 @@ def branch(il, pred, dst):
     il.append(il.if_expr(pred, t, f))
     if indirect:
         il.mark_label(t)
-        il.append(il.jump(dst))
+        il.append(il.jump(il.const_pointer(size, target)))
     il.mark_label(f)
     return None
 
 
-def dispatch_2operand(ops, op_f, flags=None):
+def dispatch_2operand(ops, rd, op_f, flags=None):
     """Handles common parts of ORL, ADD, ADDC, SUB, XRL, ..."""
     # mov has a ton of other cases too
     if ops[0] == 'data addr': # ORL/XRL/ANL only, not ADD/SUBB
@@ -403,7 +479,7 @@ def dispatch_2operand(ops, op_f, flags=None):
             def f(il,vs,ea):
                 dst = il.const_pointer(1, vs[0])
                 src = il.load(1, dst)
-                il.append(il.store(1, dst, op_f(il, src, il.reg(1, ops[1]), None)))
+                il.append(il.store(1, dst, op_f(il, src, il.reg(1, 'A'), None)))
             return f
         elif ops[1] == '#data':
             def f(il,vs,ea):
@@ -420,16 +496,17 @@ def dispatch_2operand(ops, op_f, flags=None):
             return f
         elif ops[1] == 'data addr':
             def f(il,vs,ea):
-                val = r(ops[1], il, vs[0])
-                a = il.reg(1, ops[0])
+                val = rd[1](il, vs[0])
                 il.append(il.set_reg(1, 'A', op_f(il, il.reg(1, 'A'), val, flags)))
             return f
         elif ops[1][0] == '@':
+            reg = ops[1][1:]
             def f(il,vs,ea):
-                val = il.load(1, il.add(1, il.const(1, mem.IRAM), il.reg(1, ops[1][1:])))
+                val = il.load(1, il.add(1, il.const(1, mem.IRAM), il.reg(1, reg)))
                 il.append(il.set_reg(1, 'A', op_f(il, il.reg(1, 'A'), val, flags)))
             return f
         elif ops[1][0] == 'R':  # R0..R7
+            reg = ops[1]
             def f(il,vs,ea):
-                il.append(il.set_reg(1, 'A', op_f(il, il.reg(1, 'A'), il.reg(1, ops[1]), flags)))
+                il.append(il.set_reg(1, 'A', op_f(il, il.reg(1, 'A'), il.reg(1, reg), flags)))
             return f
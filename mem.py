@@ -58,7 +58,85 @@ flags = {
 # No can do until this, I think:
 #    https://github.com/Vector35/binaryninja-api/issues/694
 
-def flash_bank_virtual(target, addr):
+class BankLayout:
+    """Flash banking geometry, for mapping between physical 16-bit code
+    addresses and our flat virtual CODE space.
+
+    Physical code is a common area at 0, always visible, followed by a
+    window that shows one of `count` banks at a time. Bank 0 is mapped in
+    place, so the first 64K of virtual space looks like an unbanked part.
+    Banks 1 and up follow back to back from `base`:
+
+        BankLayout(0x8000, 0x8000)   32K common, 32K banks at 0x8000 (default)
+        BankLayout(0xc000, 0x4000)   48K common, 16K banks at 0xc000
+        BankLayout(0, 0x10000)       whole 64K swapped, e.g. via P2 or a port
+
+    Both directions are a few integer ops, no loops or lookups.
+
+    common: physical size of the common area, also where the window starts
+    bank_size: size of the window, and of each bank
+    count: number of banks, including bank 0
+    base: virtual address (from CODE) of bank 1
+    """
+    def __init__(self, common=0x8000, bank_size=0x8000, count=16,
+                 base=0x10000):
+        assert common + bank_size <= 0x10000 <= base
+        self.common, self.bank_size, self.count = common, bank_size, count
+        self.base = base
+        self.window_end = common + bank_size
+        if self.window_end == 0x10000:  # relative branches overflowing the
+            self.window_end = 1 << 32  # top stay in the bank, as they always have
+        self.shift = base - common  # bank 1 window, virtual - physical
+
+    def key(self): return self.common, self.bank_size, self.count, self.base
+    def mapping(self):
+        """What `virtual` and `physical` depend on: `count` only bounds the
+        image, so layouts that differ in it map the same."""
+        return self.common, self.bank_size, self.base
+    def __eq__(self, other):
+        return isinstance(other, BankLayout) and self.key() == other.key()
+    def __hash__(self): return hash(self.key())
+    def __repr__(self): return 'BankLayout(%#x, %#x, %d, %#x)' % self.key()
+
+    @property
+    def end(self):
+        """Virtual address (from CODE) past the last bank."""
+        return self.base + (self.count - 1) * self.bank_size
+
+    def bank_start(self, bank):
+        """Virtual address of a bank's window."""
+        if bank == 0:
+            return CODE + self.common
+        return CODE + self.base + (bank - 1) * self.bank_size
+
+    def bank_of(self, addr):
+        """Bank a virtual address is in, 0 for the first 64K."""
+        addr -= CODE
+        if addr < self.base:
+            return 0
+        return (addr - self.base) // self.bank_size + 1
+
+    def virtual(self, target, addr):
+        """See flash_bank_virtual."""
+        addr -= CODE
+        if addr >= self.base and self.common <= target < self.window_end:
+            bank = (addr - self.base) // self.bank_size
+            target += bank * self.bank_size + self.shift
+        return target + CODE
+
+    def physical(self, addr):
+        """See flash_bank_physical."""
+        addr -= CODE
+        if addr >= self.base:
+            return self.common + (addr - self.base) % self.bank_size
+        return addr
+
+# Unless a view says otherwise. Views carry their own as
+# Family8051View.bank_layout, and get an architecture specialized for it,
+# see MCS51.variant. Never changed, since every open view would see it.
+default_layout = BankLayout()
+
+def flash_bank_virtual(target, addr, layout=None):
     """Map physical code addresses into virtual ones, for flash banking.
 
     For PC changes inside flash banks, keep them inside the bank. 
@@ -82,18 +160,12 @@ def flash_bank_virtual(target, addr):
 
     target: absolute 8051 code address space (so not based at mem.CODE)
     addr: our virtual address space based at mem.CODE, with extra banks
+    layout: BankLayout, default `default_layout`
     returns: target rebased to virtual address space
     """
-    if addr > 0xFFff and target > 0x7Fff:  # 145bb
-        bank_base_in_bndb = addr // 0x8000 * 0x8000
-        target -= 0x8000  # relocate from bank 0 to origin
-        target += bank_base_in_bndb  # relocate to own bank
-    return target + CODE
+    return (layout or default_layout).virtual(target, addr)
 
-def flash_bank_physical(addr):
+def flash_bank_physical(addr, layout=None):
     """Map virtual flash bank address back into 16-bit physical one."""
-    addr -= CODE
-    while addr > 0xFFff:
-        addr -= 0x8000 
-    return addr
+    return (layout or default_layout).physical(addr)
  
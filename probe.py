@@ -0,0 +1,131 @@
+"""Shared file probing for every 8051 BinaryView type.
+
+Binary Ninja asks each registered view type in turn whether it wants a
+newly opened file. Left alone, every device view does its own reads, and
+mass-opening a pile of firmware pays for all of them on every file.
+
+Instead, views declare the byte ranges they look at up front:
+
+    @probe.probing([(0xf030, 9)])
+    def is_valid_for_data(self, data):
+        return data.read(0xf030, 9) == b'INIC-3609'
+
+and get a Header in place of `data`. Nearby ranges from all views are
+merged, and each merged span is read at most once per file. The same cached
+spans back every view's Header until that thread probes a different file.
+Reads outside the declared ranges still work; they go to the file and show
+up as misses in `stats`.
+
+Only the spans are kept between probes, never the file's view, and a cache
+entry is keyed on the file session as well as the view handle, so a handle
+the core recycled for another file can't pick up stale bytes.
+"""
+import time, ctypes, threading, functools
+from binaryninja.log import log_info
+
+regions = []   # :: [(offset, length)] declared by all probes
+gap = 0x1000   # ranges closer than this get read together
+stats = {}     # :: {probe name: Stats}
+_stats_lock = threading.Lock()  # views get probed on several threads
+
+class Stats:
+    def __init__(self): self.calls, self.hits, self.misses, self.seconds = 0, 0, 0, 0.0
+    def __repr__(self):
+        return '%d calls, %d matched, %d uncached reads, %.3fms' % (
+            self.calls, self.hits, self.misses, self.seconds * 1000)
+
+def count(name, **deltas):
+    """Adds to one probe's Stats."""
+    with _stats_lock:
+        s = stats.setdefault(name, Stats())
+        for field, delta in deltas.items():
+            setattr(s, field, getattr(s, field) + delta)
+
+def spans():
+    """Declared regions, merged. :: [(offset, end)]"""
+    merged = []
+    for offset, length in sorted(regions):
+        if merged and offset <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], offset + length)
+        else:
+            merged.append([offset, offset + length])
+    return merged
+
+class Spans:
+    """The parts of one file that probes asked for, read once."""
+    def __init__(self, data, key):
+        self.key = key
+        self.size = len(data)
+        self.chunks = [(offset, end, data.read(offset, end - offset))
+                       for offset, end in spans()]
+        self.memo = {}  # verdicts worth sharing between probes
+
+    def get(self, offset, length):
+        """Cached bytes, or None if no span covers them."""
+        for start, end, chunk in self.chunks:
+            if start <= offset and offset + length <= end:
+                return chunk[offset - start:offset - start + length]
+        return None
+
+class Header:
+    """What a probe sees as `data` for one call: cached spans, falling back
+    to the file's view."""
+    def __init__(self, cached, data, probe=None):
+        self.cached, self.data, self.probe = cached, data, probe
+        self.memo = cached.memo
+
+    def __len__(self): return self.cached.size
+
+    def read(self, offset, length):
+        chunk = self.cached.get(offset, length)
+        if chunk is not None:
+            return chunk
+        if self.probe:
+            count(self.probe, misses=1)
+        return self.data.read(offset, length)
+
+_last = threading.local()  # .spans, for the file this thread is probing
+
+def key(data):
+    """Which file `data` is, without holding on to it."""
+    session = getattr(data.file, 'session_id', None)
+    return session, ctypes.addressof(data.handle.contents), len(data)
+
+def header(data, probe=None):
+    """Header for `data`, its spans cached until this thread moves on to
+    another file. probe: name to count uncached reads against"""
+    k = key(data)
+    cached = getattr(_last, 'spans', None)
+    if cached is None or cached.key != k:
+        start = time.time()
+        cached = _last.spans = Spans(data, k)
+        count('(reads)', calls=1, seconds=time.time() - start)
+    return Header(cached, data, probe)
+
+def probing(ranges, name=None):
+    """Decorator for is_valid_for_data(cls, data), see module docs.
+
+    ranges: [(file offset, length)] the probe reads
+    """
+    regions.extend(ranges)
+    def decorate(f):
+        @functools.wraps(f)
+        def is_valid_for_data(cls, data):
+            probe = name or cls.name
+            start = time.time()
+            found = False
+            try:
+                found = f(cls, header(data, probe))
+            finally:
+                count(probe, calls=1, hits=int(bool(found)),
+                      seconds=time.time() - start)
+            return found
+        return is_valid_for_data
+    return decorate
+
+def report():
+    """Logs per-probe timing, e.g. after opening a batch of files."""
+    with _stats_lock:
+        rows = sorted(stats.items())
+    for name, s in rows:
+        log_info('probe %-20s %r' % (name, s))
@@ -0,0 +1,296 @@
+"""Special function register names, per 8051 family.
+
+Every vendor extends the SFR space (0x80..0xff) differently. Tables below
+are transcribed from datasheets, one row per register:
+
+    addr  name     bit7 bit6 bit5 bit4 bit3 bit2 bit1 bit0
+
+Bit names are only given for bit-addressable registers (address divisible
+by 8), '-' for reserved bits. A family starts from its parent's table and
+overrides by address; rows without bit names keep the parent's bits.
+
+Lookups are flat 256-entry lists indexed by direct address (and bit), since
+these get hit for every rendered operand. The 5 registers in `mem.regs` are
+lifted as real registers, and their names always win.
+"""
+from . import mem
+
+_8051 = """
+80  P0
+81  SP
+82  DPL
+83  DPH
+87  PCON
+88  TCON    TF1  TR1  TF0  TR0  IE1  IT1  IE0  IT0
+89  TMOD
+8a  TL0
+8b  TL1
+8c  TH0
+8d  TH1
+90  P1
+98  SCON    SM0  SM1  SM2  REN  TB8  RB8  TI   RI
+99  SBUF
+a0  P2
+a8  IE      EA   -    -    ES   ET1  EX1  ET0  EX0
+b0  P3      RD   WR   T1   T0   INT1 INT0 TXD  RXD
+b8  IP      -    -    -    PS   PT1  PX1  PT0  PX0
+d0  PSW     CY   AC   F0   RS1  RS0  OV   -    P
+e0  ACC
+f0  B
+"""
+
+_8052 = """
+a8  IE      EA   -    ET2  ES   ET1  EX1  ET0  EX0
+b8  IP      -    -    PT2  PS   PT1  PX1  PT0  PX0
+c8  T2CON   TF2  EXF2 RCLK TCLK EXEN2 TR2 C_T2 CP_RL2
+c9  T2MOD
+ca  RCAP2L
+cb  RCAP2H
+cc  TL2
+cd  TH2
+"""
+
+# Silicon Labs C8051F34x, SFR page 0. The rest of the C8051F line shares
+# most of these.
+_c8051f = """
+8e  CKCON
+8f  PSCTL
+98  SCON0   S0MODE -  MCE0 REN0 TB80 RB80 TI0  RI0
+99  SBUF0
+a4  P0MDOUT
+a5  P1MDOUT
+a6  P2MDOUT
+a7  P3MDOUT
+a8  IE      EA   ESPI0 ET2 ES0  ET1  EX1  ET0  EX0
+b1  OSCXCN
+b2  OSCICN
+b3  OSCICL
+b6  FLSCL
+b7  FLKEY
+b8  IP      -    PSPI0 PT2 PS0  PT1  PX1  PT0  PX0
+c0  SMB0CN  MASTER TXMODE STA STO ACKRQ ARBLOST ACK SI
+c1  SMB0CF
+c2  SMB0DAT
+c8  TMR2CN  TF2H TF2L TF2LEN T2CE T2SPLIT TR2 T2CSS T2XCLK
+ca  TMR2RLL
+cb  TMR2RLH
+cc  TMR2L
+cd  TMR2H
+d8  PCA0CN  CF   CR   -    CCF4 CCF3 CCF2 CCF1 CCF0
+d9  PCA0MD
+e1  XBR0
+e2  XBR1
+e6  EIE1
+e8  ADC0CN  AD0EN AD0TM AD0INT AD0BUSY AD0WINT AD0CM2 AD0CM1 AD0CM0
+ef  RSTSRC
+f1  P0MDIN
+f2  P1MDIN
+f6  EIP1
+f8  SPI0CN  SPIF WCOL MODF RXOVRN NSSMD1 NSSMD0 TXBMT SPIEN
+ff  VDM0CN
+"""
+
+# Nuvoton N76E003, page 0.
+_n76e003 = """
+84  RCTRIM0
+85  RCTRIM1
+86  RWK
+8e  CKCON
+8f  WKCON
+91  SFRS
+92  CAPCON0
+93  CAPCON1
+94  CAPCON2
+95  CKDIV
+96  CKSWT
+97  CKEN
+9a  SBUF_1
+9b  EIE
+9c  EIE1
+9f  CHPCON
+a2  AUXR1
+a3  BODCON0
+a4  IAPTRG
+a5  IAPUEN
+a6  IAPAL
+a7  IAPAH
+a8  IE      EA   EADC EBOD ES   ET1  EX1  ET0  EX0
+a9  SADDR
+aa  WDCON
+ab  BODCON1
+ac  P3M1
+ad  P3M2
+ae  IAPFD
+af  IAPCN
+b1  P0M1
+b2  P0M2
+b3  P1M1
+b4  P1M2
+b5  P2S
+b7  IPH
+b8  IP      -    PADC PBOD PS   PT1  PX1  PT0  PX0
+b9  SADEN
+ba  SADEN_1
+bb  SADDR_1
+bc  I2DAT
+bd  I2STAT
+be  I2CLK
+bf  I2TOC
+c0  I2CON   -    I2CEN STA STO  SI   AA   -    I2CPX
+c1  I2ADDR
+c2  ADCRL
+c3  ADCRH
+c4  T3CON
+c5  RL3
+c6  RH3
+c7  TA
+c8  T2CON   TF2  -    -    -    -    TR2  -    CM_RL2
+c9  T2MOD
+ca  RCMP2L
+cb  RCMP2H
+ce  ADCMPL
+cf  ADCMPH
+e8  ADCCON0 ADCF ADCS ETGSEL1 ETGSEL0 ADCHS3 ADCHS2 ADCHS1 ADCHS0
+f8  SCON_1  SM0_1 SM1_1 SM2_1 REN_1 TB8_1 RB8_1 TI_1 RI_1
+"""
+
+# Maxim (Teridian) 73S1215F, Table 6 of DS_1215F_003. An 80515-style core:
+# second DPTR, second UART, more external interrupts, no timer 2. The USB,
+# smart card and keypad blocks are external SFRs up in XRAM, not here.
+_73s1215f = """
+84  DPL1
+85  DPH1
+86  WDTREL
+8e  CKCON
+92  DPS
+94  ERASE
+98  S0CON   SM0  SM1  SM20 REN0 TB80 RB80 TI0  RI0
+99  S0BUF
+9a  IEN2
+9b  S1CON
+9c  S1BUF
+9d  S1RELL
+a8  IEN0    EAL  WDT  -    ES0  ET1  EX1  ET0  EX0
+a9  IP0
+aa  S0RELL
+b2  FLSHCTL
+b7  PGADR
+b8  IEN1    -    SWDT EX6  EX5  EX4  EX3  EX2  -
+b9  IP1
+ba  S0RELH
+bb  S1RELH
+c0  IRCON   -    -    IEX6 IEX5 IEX4 IEX3 IEX2 -
+d8  WDCON
+f8  INTBITS
+"""
+
+# :: {family: (parent family | None, table)}
+families = {
+    '8051': (None, _8051),
+    '8052': ('8051', _8052),
+    'c8051f': ('8051', _c8051f),
+    'n76e003': ('8052', _n76e003),
+    '73s1215f': ('8051', _73s1215f),
+}
+
+def parse(table):
+    """-> [(addr, name, [bit names, bit 0 first] | None)]"""
+    rows = []
+    for line in table.strip().splitlines():
+        cols = line.split()
+        bits = cols[2:][::-1] if len(cols) > 2 else None
+        if bits is not None and len(bits) != 8:
+            raise ValueError('Need 8 bit names for %r' % line)
+        rows.append((int(cols[0], 16), cols[1], bits))
+    return rows
+
+class SfrDatabase:
+    """Names for one family, indexed by address.
+
+    names :: [name | None] by direct address, 0x80.. only
+    bits :: [[name | None]*8 | None] by direct address of the byte
+    """
+    def __init__(self, family):
+        self.family = family
+        self.names = [None] * 0x100
+        self.bits = [None] * 0x100
+        chain = []
+        while family:
+            parent, table = families[family]
+            chain.append(table)
+            family = parent
+        for table in reversed(chain):
+            for addr, name, bits in parse(table):
+                self.names[addr] = name
+                if bits:
+                    self.bits[addr] = [None if b == '-' else b for b in bits]
+        for ea, name in mem.regs.items():  # lifted registers keep their names
+            self.names[ea - mem.SFRs] = name
+
+    def __iter__(self):
+        """:: (addr, name) for every named SFR"""
+        return ((addr, name) for addr, name in enumerate(self.names) if name)
+
+    def bit_name(self, addr, bit):
+        return self.bits[addr] and self.bits[addr][bit]
+
+_loaded = {}
+
+def database(family):
+    """SfrDatabase for `family`, built once."""
+    if family not in _loaded:
+        _loaded[family] = SfrDatabase(family)
+    return _loaded[family]
+
+
+class Operands:
+    """Direct and bit operands as rendered for one family, by address byte
+    (and bit), for every address ana_op can produce. Parts are plain
+    (kind, text, value) with kind one of 'register', 'address', 'integer',
+    'text', so out can make tokens of them and disassembler.batch text,
+    and the two listings agree.
+    """
+    def __init__(self, db):
+        self.direct = [_direct(lo, db) for lo in range(0x100)]
+        self.bits = [None] * 0x100
+        for lo in list(range(0x20, 0x30)) + list(range(0x80, 0x100, 8)):
+            self.bits[lo] = [_bit(lo, bit, db) for bit in range(8)]
+
+def _hex(val): return hex(val)[2:] + 'h'  # like out.hx
+
+def _direct(lo, db):
+    target = mem.IRAM + lo if lo < 0x80 else mem.SFRs + lo
+    if target in mem.regs:
+        # for special memory-mapped registers, render them as proper regs
+        if mem.regs[target] == 'A':
+            # lol assembler roundtrip
+            return [('register', 'A', 0), ('text', 'CC', 0)]
+        return [('register', mem.regs[target], 0)]
+    name = db.names[lo] if lo >= 0x80 else None
+    return [('address', name or _hex(lo), target)]
+
+def _bit(lo, bit, db):
+    byte = mem.IRAM + lo if lo < 0x80 else mem.SFRs + lo
+    if byte == mem.PSW and bit in mem.flags:
+        # Treat memory-mapped flag access as an actual flag.
+        # This won't be sound for code that reads PSW then does manual
+        # bitshifts to extract flags, but oh well. :(
+        return [('register', mem.flags[bit], 0)]
+    if byte in mem.regs:
+        byte_part = ('register', mem.regs[byte], 0)
+    else:
+        name = db.names[lo] if lo >= 0x80 else None
+        byte_part = ('address', name or _hex(lo), byte)
+    # Named bits keep their byte too, so both stay clickable/hoverable.
+    bit_name = db.bit_name(lo, bit) if lo >= 0x80 else None
+    return [byte_part,
+            ('text', '.', 0), # hmm, non-std syntax? :|
+            ('integer', bit_name or str(bit), bit)]
+
+_operands = {}
+
+def operands(family):
+    """Operands for `family`, built once."""
+    if family not in _operands:
+        _operands[family] = Operands(database(family))
+    return _operands[family]